@@ -35276,6 +35276,12 @@ async function run() {
 
     // Run log analysis if any job failed
     if (failedJobs.length > 0) {
+      // Fetch the tokenizer's BPE file, unless TIKTOKEN_CACHE_DIR already holds
+      // it from the workflow's cache. Analysis never downloads it and falls back
+      // to approximate token counts when it is missing, so a failure is not fatal.
+      console.log('Warming tokenizer cache...');
+      await exec.exec('bash', ['-c', 'source myenv/bin/activate && python script/debug_fetch_logs.py --warm-tokenizer-cache'], { ignoreReturnCode: true });
+
       console.log('Running log analysis...');
       console.log(`Passing to Python: REPO_OWNER=${repoOwner}, REPO_NAME=${repoName}, GITHUB_RUN_ID=${runId}, GITHUB_TOKEN=${githubToken}, CUSTOM_SERVICE_COOKIE=${customServiceCookie}`);
     
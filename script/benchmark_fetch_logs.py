@@ -0,0 +1,453 @@
+import argparse
+import json
+import os
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Runs debug_fetch_logs.py end to end against local stand-ins for the GitHub
+# jobs/logs endpoints and the analysis service, on synthetic Actions logs,
+# and reports wall time per phase, peak RSS and bytes transferred.
+
+SCRIPT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "debug_fetch_logs.py")
+DATA_DIR = os.path.join(tempfile.gettempdir(), "logs_summary_benchmark")
+LOG_SHAPES = ["pytest", "npm", "gradle", "compiler"]
+LOG_SIZES_MB = [1, 10, 100]  # Up to 1024 for the largest runners
+FAILED_JOBS = 4
+RUN_ID = 1
+LOG_START = datetime(2024, 1, 1, tzinfo=timezone.utc)
+LINES_PER_SECOND = 1000  # Synthetic log clock: one timestamp millisecond per line
+SERVE_CHUNK_SIZE = 1024 * 1024
+STEP_NAMES = ["Set up job", "Run actions/checkout@v4", "Install dependencies", "Run tests"]
+
+# Passing output that makes up the bulk of each log shape, and the failure
+# written at its end. {n} is the line number and {job} names the failing
+# test, differently per job unless --same-failure is given.
+PASSING_LINES = {
+    "pytest": [
+        "tests/unit/test_module_{m}.py::test_case_{n} PASSED                       [ {p}%]",
+        "tests/integration/test_api_{m}.py::TestClient::test_request_{n} PASSED     [ {p}%]",
+    ],
+    "npm": [
+        "npm http fetch GET 200 https://registry.npmjs.org/package-{m} {n}ms (cache revalidated)",
+        "PASS src/components/Widget{m}.test.js ({p}.{m} s)",
+        "  ✓ renders item {n} ({m} ms)",
+    ],
+    "gradle": [
+        "> Task :module-{m}:compileJava UP-TO-DATE",
+        "> Task :module-{m}:test",
+        "com.example.module{m}.ServiceTest > handlesRequest{n}() PASSED",
+    ],
+    "compiler": [
+        "gcc -c -O2 -Wall -Iinclude src/unit_{m}/file_{n}.c -o build/unit_{m}/file_{n}.o",
+        "[ {p}%] Building C object CMakeFiles/app.dir/src/unit_{m}/file_{n}.c.o",
+    ],
+}
+FAILURE_LINES = {
+    "pytest": [
+        "=================================== FAILURES ===================================",
+        "_______________________________ test_parse_{job} _______________________________",
+        "    def test_parse_{job}():",
+        ">       assert parse('input-{job}') == {job}",
+        "E       AssertionError: assert None == {job}",
+        "tests/unit/test_parse.py:{line}: AssertionError",
+        "=========================== short test summary info ============================",
+        "FAILED tests/unit/test_parse.py::test_parse_{job} - AssertionError: assert None == {job}",
+        "1 failed, 4812 passed in 312.4s",
+    ],
+    "npm": [
+        "FAIL src/components/Parser{job}.test.js",
+        "  ● Parser{job} › parses input",
+        "    expect(received).toEqual(expected)",
+        "    Expected: {job}",
+        "    Received: undefined",
+        "      at Object.<anonymous> (src/components/Parser{job}.test.js:{line}:23)",
+        "Tests:       1 failed, 2210 passed, 2211 total",
+        "npm ERR! code ELIFECYCLE",
+        "npm ERR! errno 1",
+    ],
+    "gradle": [
+        "com.example.parser.Parser{job}Test > parsesInput() FAILED",
+        "    org.opentest4j.AssertionFailedError: expected: <{job}> but was: <null>",
+        "        at com.example.parser.Parser{job}Test.parsesInput(Parser{job}Test.java:{line})",
+        "FAILURE: Build failed with an exception.",
+        "* What went wrong:",
+        "Execution failed for task ':parser:test'.",
+        "> There were failing tests. See the report at: file:///home/runner/work/app/parser/build/reports/tests/test/index.html",
+    ],
+    "compiler": [
+        "src/net/parser_{job}.c:{line}:5: error: 'parse_token_{job}' undeclared (first use in this function)",
+        "src/net/parser_{job}.c:{line}:5: note: each undeclared identifier is reported only once",
+        "make[2]: *** [CMakeFiles/app.dir/build.make:{line}: CMakeFiles/app.dir/src/net/parser_{job}.c.o] Error 1",
+        "make[1]: *** [CMakeFiles/Makefile2:83: CMakeFiles/app.dir/all] Error 2",
+    ],
+}
+FAILURE_NAMES = ["parse", "render", "encode", "decode", "merge", "split", "load", "save"]
+
+def log_timestamp(line):
+    moment = LOG_START + timedelta(seconds=line / LINES_PER_SECOND)
+    return moment.strftime("%Y-%m-%dT%H:%M:%S.") + f"{moment.microsecond:06d}0Z"
+
+def api_timestamp(line):
+    return (LOG_START + timedelta(seconds=line // LINES_PER_SECOND)).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+def generate_log_body(shape, size_mb, data_dir):
+    # Writes the shared passing part of a synthetic log (setup steps, then
+    # the test step's output) once per shape and size, and records the line
+    # where each step starts so the jobs API can report step times.
+    path = os.path.join(data_dir, f"{shape}_{size_mb}mb.log")
+    meta_path = path + ".json"
+    if os.path.exists(path) and os.path.exists(meta_path):
+        with open(meta_path) as meta_file:
+            return path, json.load(meta_file)
+
+    os.makedirs(data_dir, exist_ok=True)
+    print(f"Generating {size_mb} MB {shape} log in {path}")
+    rng = random.Random(f"{shape}-{size_mb}")
+    target = size_mb * 1024 * 1024
+    step_starts = []
+    line = 0
+    written = 0
+    with open(path + ".tmp", 'w', encoding='utf-8') as file:
+        def write(text):
+            nonlocal line, written
+            data = f"{log_timestamp(line)} {text}\n"
+            file.write(data)
+            written += len(data.encode('utf-8'))
+            line += 1
+
+        step_starts.append(line)
+        write("Current runner version: '2.317.0'")
+        write("Operating System")
+        step_starts.append(line)
+        write("##[group]Run actions/checkout@v4")
+        write("##[endgroup]")
+        write("Syncing repository: example/app")
+        step_starts.append(line)
+        write("##[group]Run ./install.sh")
+        for n in range(200):
+            write(f"Downloading dependency-{n}-1.{n % 10}.0.tar.gz ({rng.randint(10, 900)} kB)")
+        write("##[endgroup]")
+        step_starts.append(line)
+        write("##[group]Run ./run_tests.sh")
+        write("##[endgroup]")
+        templates = PASSING_LINES[shape]
+        while written < target:
+            n = line
+            write(templates[n % len(templates)].format(n=n, m=n % 97, p=min(99, written * 100 // target)))
+    os.replace(path + ".tmp", path)
+    meta = {"step_starts": step_starts, "lines": line, "bytes": written}
+    with open(meta_path, 'w') as meta_file:
+        json.dump(meta, meta_file)
+    return path, meta
+
+def failure_tail(shape, first_line, job_index, same_failure):
+    # Failures are told apart by words rather than numbers, since numbers
+    # are masked when jobs are clustered by failure.
+    index = 0 if same_failure else job_index
+    job = FAILURE_NAMES[index % len(FAILURE_NAMES)] + FAILURE_NAMES[index // len(FAILURE_NAMES) % len(FAILURE_NAMES)].title()
+    lines = [text.format(job=job, line=40 + index) for text in FAILURE_LINES[shape]]
+    lines.append("##[error]Process completed with exit code 1.")
+    data = "".join(f"{log_timestamp(first_line + i)} {text}\n" for i, text in enumerate(lines))
+    return data.encode('utf-8'), first_line + len(lines)
+
+class BenchmarkServer:
+    # Stand-in for the GitHub API, blob storage and the analysis service on
+    # one local port. Counts requests and bytes, and records when each kind
+    # of request first started and last finished, relative to reset().
+    def __init__(self, api_latency, llm_latency):
+        self.api_latency = api_latency
+        self.llm_latency = llm_latency
+        self.lock = threading.Lock()
+        self.jobs = []
+        self.logs = {}
+        self.reset()
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self.handler_class())
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def reset(self):
+        with self.lock:
+            self.started = time.perf_counter()
+            self.stats = {}
+
+    def record(self, kind, started, bytes_in=0, bytes_out=0):
+        finished = time.perf_counter()
+        with self.lock:
+            entry = self.stats.setdefault(kind, {"requests": 0, "bytes_in": 0, "bytes_out": 0,
+                                                 "first_start": None, "last_end": None})
+            entry["requests"] += 1
+            entry["bytes_in"] += bytes_in
+            entry["bytes_out"] += bytes_out
+            start, end = started - self.started, finished - self.started
+            entry["first_start"] = start if entry["first_start"] is None else min(entry["first_start"], start)
+            entry["last_end"] = end if entry["last_end"] is None else max(entry["last_end"], end)
+
+    def load_run(self, shape, size_mb, jobs, same_failure, data_dir):
+        body_path, meta = generate_log_body(shape, size_mb, data_dir)
+        body_size = os.path.getsize(body_path)
+        self.jobs = []
+        self.logs = {}
+        for index in range(jobs):
+            job_id = 1000 + index
+            tail, end_line = failure_tail(shape, meta["lines"], index, same_failure)
+            self.logs[job_id] = (body_path, body_size, tail)
+            starts = meta["step_starts"] + [end_line]
+            steps = [{
+                "name": name,
+                "number": number + 1,
+                "status": "completed",
+                "conclusion": "failure" if number == len(STEP_NAMES) - 1 else "success",
+                "started_at": api_timestamp(starts[number]),
+                "completed_at": api_timestamp(starts[number + 1] - 1),
+            } for number, name in enumerate(STEP_NAMES)]
+            self.jobs.append({"id": job_id, "name": f"{shape}-job-{index}", "status": "completed",
+                              "conclusion": "failure", "steps": steps})
+
+    def handler_class(self):
+        bench = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def send(self, code, body=b"", headers=None):
+                self.send_response(code)
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+                return len(body)
+
+            def do_GET(self):
+                started = time.perf_counter()
+                path, _, query = self.path.partition("?")
+                parts = path.strip("/").split("/")
+                if path.endswith(f"/actions/runs/{RUN_ID}/jobs"):
+                    time.sleep(bench.api_latency)
+                    params = dict(item.split("=", 1) for item in query.split("&") if "=" in item)
+                    per_page, page = int(params.get("per_page", 30)), int(params.get("page", 1))
+                    jobs = bench.jobs[(page - 1) * per_page:page * per_page]
+                    body = json.dumps({"total_count": len(bench.jobs), "jobs": jobs}).encode()
+                    sent = self.send(200, body, {"Content-Type": "application/json"})
+                    bench.record("jobs", started, bytes_out=sent)
+                elif path.endswith("/logs") and parts[-3] == "jobs":
+                    time.sleep(bench.api_latency)
+                    self.send(302, b"", {"Location": f"{bench.url}/blob/{parts[-2]}"})
+                    bench.record("logs_redirect", started)
+                elif parts[0] == "blob":
+                    bench.record("blob", started, bytes_out=self.send_log(int(parts[1])))
+                else:
+                    self.send(404, b"{}")
+
+            def send_log(self, job_id):
+                body_path, body_size, tail = bench.logs[job_id]
+                total = body_size + len(tail)
+                start, end = 0, total - 1
+                byte_range = self.headers.get("Range")
+                if byte_range:
+                    first, _, last = byte_range.split("=", 1)[1].partition("-")
+                    if first:
+                        start, end = int(first), min(int(last) if last else total - 1, total - 1)
+                    else:
+                        start = max(0, total - int(last))
+                    self.send_response(206)
+                    self.send_header("Content-Range", f"bytes {start}-{end}/{total}")
+                else:
+                    self.send_response(200)
+                self.send_header("Content-Type", "text/plain")
+                self.send_header("Content-Length", str(end - start + 1))
+                self.end_headers()
+
+                # Stream the shared body from disk, then this job's failure.
+                sent = 0
+                with open(body_path, 'rb') as file:
+                    file.seek(min(start, body_size))
+                    position = start
+                    while position <= end and position < body_size:
+                        data = file.read(min(SERVE_CHUNK_SIZE, end + 1 - position, body_size - position))
+                        self.wfile.write(data)
+                        position += len(data)
+                        sent += len(data)
+                if end >= body_size:
+                    data = tail[max(0, start - body_size):end + 1 - body_size]
+                    self.wfile.write(data)
+                    sent += len(data)
+                return sent
+
+            def do_POST(self):
+                started = time.perf_counter()
+                request_body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                payload = json.loads(request_body)
+                time.sleep(bench.llm_latency)
+                summary = f"Root cause: synthetic failure ({len(request_body)} request bytes)"
+                if payload.get("stream"):
+                    sent = self.send_stream(summary)
+                else:
+                    body = json.dumps({"choices": [{"message": {"content": summary}}]}).encode()
+                    sent = self.send(200, body, {"Content-Type": "application/json"})
+                bench.record("analysis", started, bytes_in=len(request_body), bytes_out=sent)
+
+            def send_stream(self, summary):
+                events = [json.dumps({"choices": [{"delta": {"content": word + " "}}]}) for word in summary.split()]
+                body = "".join(f"data: {event}\n\n" for event in events + ["[DONE]"]).encode()
+                return self.send(200, body, {"Content-Type": "text/event-stream"})
+
+        return Handler
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+def phase_times(stats, wall):
+    # Phases overlap once jobs run concurrently, so each one is the span from
+    # the first request of its kind starting to the last one finishing.
+    def span(*kinds):
+        entries = [stats[kind] for kind in kinds if kind in stats]
+        if not entries:
+            return 0.0
+        return max(entry["last_end"] for entry in entries) - min(entry["first_start"] for entry in entries)
+
+    first_request = min((entry["first_start"] for entry in stats.values()), default=wall)
+    last_response = max((entry["last_end"] for entry in stats.values()), default=wall)
+    return {
+        "startup": first_request,
+        "list_jobs": span("jobs"),
+        "download": span("logs_redirect", "blob"),
+        "analysis": span("analysis"),
+        "shutdown": max(0.0, wall - last_response),
+    }
+
+def run_once(server, args, extra_args):
+    work_dir = tempfile.mkdtemp(prefix="logs_summary_bench_")
+    os.makedirs(os.path.join(work_dir, "script"))
+    env = dict(os.environ,
+               GITHUB_API_URL=server.url,
+               CUSTOM_SERVICE_URL=f"{server.url}/analysis",
+               CUSTOM_SERVICE_COOKIE="benchmark",
+               REPO_OWNER="example",
+               REPO_NAME="app",
+               GITHUB_RUN_ID=str(RUN_ID),
+               GITHUB_TOKEN="benchmark",
+               SUMMARY_CACHE_PATH=os.path.join(work_dir, "summaries.db"),
+               HTTP_CACHE_DIR=os.path.join(work_dir, "http"))
+    output_path = os.path.join(work_dir, "output.txt")
+    try:
+        with open(output_path, 'w') as output:
+            server.reset()
+            process = subprocess.Popen([sys.executable, SCRIPT_PATH, *extra_args], cwd=work_dir, env=env,
+                                       stdout=output, stderr=subprocess.STDOUT)
+            _, status, usage = os.wait4(process.pid, 0)
+            wall = time.perf_counter() - server.started
+            process.returncode = os.waitstatus_to_exitcode(status)
+        if process.returncode != 0:
+            with open(output_path) as output:
+                print(output.read()[-4000:])
+            raise Exception(f"debug_fetch_logs.py exited with {process.returncode}")
+        with server.lock:
+            stats = json.loads(json.dumps(server.stats))
+        return {
+            "wall_seconds": wall,
+            "phases": phase_times(stats, wall),
+            "peak_rss_mb": usage.ru_maxrss / 1024,  # ru_maxrss is in KiB on Linux
+            "bytes_downloaded": stats.get("blob", {}).get("bytes_out", 0),
+            "bytes_sent_for_analysis": stats.get("analysis", {}).get("bytes_in", 0),
+            "analysis_requests": stats.get("analysis", {}).get("requests", 0),
+            "api_requests": sum(stats.get(kind, {}).get("requests", 0) for kind in ("jobs", "logs_redirect", "blob")),
+        }
+    finally:
+        if not args.keep_work_dirs:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+def median_result(results):
+    # Medians across repeats, metric by metric.
+    merged = {}
+    for key, value in results[0].items():
+        if isinstance(value, dict):
+            merged[key] = {name: statistics.median(result[key][name] for result in results) for name in value}
+        else:
+            merged[key] = statistics.median(result[key] for result in results)
+    return merged
+
+def print_result(name, result):
+    phases = ", ".join(f"{phase} {seconds:.2f}s" for phase, seconds in result["phases"].items())
+    print(f"{name}: {result['wall_seconds']:.2f}s wall ({phases})")
+    print(f"  peak RSS {result['peak_rss_mb']:.1f} MB, downloaded {result['bytes_downloaded'] / 1048576:.1f} MB, "
+          f"sent for analysis {result['bytes_sent_for_analysis'] / 1024:.1f} KB "
+          f"in {result['analysis_requests']:.0f} requests, {result['api_requests']:.0f} GitHub/blob requests")
+
+def compare_results(baseline, results):
+    # Prints each metric next to the baseline's, as a relative change.
+    def flatten(result):
+        flat = {f"phase {name}": seconds for name, seconds in result["phases"].items()}
+        flat.update({key: value for key, value in result.items() if not isinstance(value, dict)})
+        return flat
+
+    for name, result in results.items():
+        if name not in baseline:
+            print(f"{name}: not in baseline")
+            continue
+        print(f"{name} vs baseline:")
+        old, new = flatten(baseline[name]), flatten(result)
+        for metric, value in new.items():
+            if metric not in old:
+                continue
+            change = (value - old[metric]) / old[metric] * 100 if old[metric] else 0.0
+            print(f"  {metric}: {old[metric]:.2f} -> {value:.2f} ({change:+.1f}%)")
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark debug_fetch_logs.py against local stand-in servers.')
+    parser.add_argument('--shapes', default=",".join(LOG_SHAPES), help='Comma-separated log shapes: ' + ", ".join(LOG_SHAPES))
+    parser.add_argument('--sizes-mb', default=",".join(map(str, LOG_SIZES_MB)), help='Comma-separated log sizes in MB')
+    parser.add_argument('--jobs', type=int, default=FAILED_JOBS, help='Failed jobs in each synthetic run')
+    parser.add_argument('--same-failure', action='store_true', help='Give every job the same failure, like a failing matrix')
+    parser.add_argument('--repeat', type=int, default=1, help='Runs per shape and size; the median is reported')
+    parser.add_argument('--api-latency-ms', type=float, default=50, help='Added latency of GitHub API responses')
+    parser.add_argument('--llm-latency-ms', type=float, default=500, help='Added latency of analysis service responses')
+    parser.add_argument('--data-dir', default=DATA_DIR, help='Where generated logs are kept between runs')
+    parser.add_argument('--save-baseline', help='Write the results to this JSON file')
+    parser.add_argument('--compare', help='Compare the results with a baseline JSON file')
+    parser.add_argument('--keep-work-dirs', action='store_true', help='Keep each run\'s working directory and output')
+    parser.add_argument('script_args', nargs=argparse.REMAINDER, help='Arguments for debug_fetch_logs.py, after --')
+    args = parser.parse_args()
+    extra_args = args.script_args[1:] if args.script_args[:1] == ["--"] else args.script_args
+
+    server = BenchmarkServer(args.api_latency_ms / 1000, args.llm_latency_ms / 1000)
+    results = {}
+    try:
+        for shape in args.shapes.split(","):
+            if shape not in LOG_SHAPES:
+                raise Exception(f"Unknown log shape {shape}; choose from {', '.join(LOG_SHAPES)}")
+            for size_mb in map(int, args.sizes_mb.split(",")):
+                server.load_run(shape, size_mb, args.jobs, args.same_failure, args.data_dir)
+                name = f"{shape}/{size_mb}MB"
+                results[name] = median_result([run_once(server, args, extra_args) for _ in range(max(1, args.repeat))])
+                print_result(name, results[name])
+    finally:
+        server.close()
+
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            compare_results(json.load(baseline_file)["results"], results)
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as baseline_file:
+            json.dump({"script_args": extra_args, "jobs": args.jobs, "results": results}, baseline_file, indent=2)
+        print(f"Saved results to {args.save_baseline}")
+
+if __name__ == "__main__":
+    main()
@@ -1,50 +1,1224 @@
+import time
+
+PROCESS_START = time.perf_counter()
+
 import argparse
+import bisect
+import gzip
+import hashlib
+import importlib
+import json
+import math
+import mmap
+import multiprocessing
 import os
+import random
+import re
+import shutil
 import sys
-import requests
-from datetime import datetime
-import tiktoken  # OpenAI's tokenizer package
-
+import threading
+import zipfile
+from array import array
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlencode, urlsplit
+
+# requests, tiktoken and sqlite3 are imported on first use (see timed_import),
+# so a run that finds no failed steps does not pay for loading them.
+requests = None
+STARTUP_TIMINGS = [("import standard library", time.perf_counter() - PROCESS_START)]
+
+TOKENIZER_ENCODING = "cl100k_base"
+TOKENIZER_BLOB_URL = "https://openaipublic.blob.core.windows.net/encodings/cl100k_base.tiktoken"
+TOKENIZER_CACHE_DIR = os.getenv("TIKTOKEN_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".tiktoken_cache"))
 MAX_TOKENS = 1000  # Adjust according to the model's limit, e.g., 8000 for GPT-4 (8K context)
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024  # Bytes held in memory at a time while streaming a log to disk
+MAX_LOG_MEMORY_MB = 64  # Upper bound on the log text kept in memory for analysis
+TAIL_FETCH_MB = 2  # First range fetched from the end of a job log with --tail-first
+CPU_PARTITION_MIN_MB = 16  # Smaller logs are preprocessed in-process even with --cpu-workers
+GITHUB_API_URL = os.getenv("GITHUB_API_URL", "https://api.github.com")
+JOBS_PER_PAGE = 100  # Largest page size the jobs API accepts
+MAX_PAGE_WORKERS = 8  # Concurrent requests used to fetch the remaining job pages
+CONTEXT_LINES_BEFORE = 20  # Log lines kept before each failure marker
+CONTEXT_LINES_AFTER = 10  # Log lines kept after each failure marker
+FAILURE_WINDOW_SEPARATOR = "...\n"
+STEP_TAIL_LINES = 5  # Log lines kept after a failed step, where the runner reports its exit code
+ARCHIVE_UNSAFE_CHARS = re.compile(r'[<>:"/\\|?*]')  # Characters GitHub drops from job names in the run log archive
+CUSTOM_SERVICE_URL = os.getenv("CUSTOM_SERVICE_URL", "https://www.dex.inside.philips.com/philips-ai-chat/chat/api/user/SendImageMessage")
+MAX_IN_FLIGHT_REQUESTS = 4  # Concurrent requests to the analysis service across all jobs
+STREAM_FIRST_BYTE_TIMEOUT = 60  # Seconds a streamed analysis may wait for its first and each next event
+STREAM_TOTAL_TIMEOUT = 600  # Seconds a streamed analysis may take end to end
+
+MAP_PROMPT = "This is part {part} of {parts} of a failed GitHub Actions job log. Summarize any errors or failures in this part, with the file name, line number and code where they occurred. Reply 'No errors' if there are none:\n\n"
+REDUCE_PROMPT = "The following are summaries of consecutive parts of a failed GitHub Actions job log.\n"
+
+SUMMARY_CACHE_PATH = os.getenv("SUMMARY_CACHE_PATH", os.path.expanduser("~/.cache/logs_summary_action/summaries.db"))
+SUMMARY_CACHE_TTL_HOURS = 7 * 24
+SUMMARY_CACHE_MAX_ENTRIES = 5000
+CLUSTER_MAX_DISTANCE = 3  # Differing SimHash bits (of 64) tolerated between jobs with the same failure
+
+ANSI_ESCAPE = re.compile(r"\x1b\[[0-9;?]*[A-Za-z]")
+ACTIONS_TIMESTAMP = re.compile(r"^\d{4}-\d\d-\d\dT\d\d:\d\d:\d\d(?:\.\d+)?Z ?", re.MULTILINE)
+ACTIONS_TIMESTAMP_BYTES = re.compile(rb"\d{4}-\d\d-\d\dT\d\d:\d\d:\d\d")
+ACTIONS_TIMESTAMP_LENGTH = len("2024-01-01T00:00:00")  # Compared to whole seconds, as the jobs API reports them
+
+# Run-specific details replaced before a failure excerpt is hashed, so the
+# same failure in a different run maps to the same cache entry.
+FAILURE_SIGNATURE_PATTERNS = [
+    (re.compile(r"\d{4}-\d\d-\d\d[T ]\d\d:\d\d:\d\d(?:\.\d+)?(?:Z|[+-]\d\d:?\d\d)?"), "<time>"),
+    (re.compile(r"(?:/tmp/|/var/folders/|/home/runner/work/_temp/|[A-Za-z]:\\[^\s]*\\Temp\\)[^\s'\"]*"), "<tmp>"),
+    (re.compile(r"\b[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}\b"), "<uuid>"),
+    (re.compile(r"\b[0-9a-f]{12,64}\b"), "<hash>"),
+    (re.compile(r"\b\d{6,}\b"), "<id>"),
+    (re.compile(r"\b\d+(?:\.\d+)?\s?(?:ms|s|sec|seconds)\b"), "<duration>"),
+]
+
+HTTP_CONNECT_TIMEOUT = 10  # Seconds to establish a connection
+HTTP_READ_TIMEOUT = 300  # Seconds to wait for the next bytes of a response
+HTTP_MAX_RETRIES = 4
+HTTP_BACKOFF_BASE = 1.0  # Seconds; doubled on every retry, with full jitter
+HTTP_BACKOFF_MAX = 60.0
+HTTP_MAX_RATE_LIMIT_WAIT = 900  # Longest wait for a rate limit reset before giving up
+HTTP_SECONDARY_RATE_LIMIT_WAIT = 60  # GitHub asks for at least a minute after a secondary rate limit without Retry-After
+HTTP_POOL_SIZE = 16  # Connections kept open per host
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+custom_service_slots = threading.BoundedSemaphore(MAX_IN_FLIGHT_REQUESTS)
+WATCH_MIN_INTERVAL = 5  # Seconds between polls right after a job changed status
+WATCH_MAX_INTERVAL = 60  # Longest wait between polls while nothing changes
+WATCH_BACKOFF_FACTOR = 1.5
+WATCH_TIMEOUT = 3 * 3600
+WATCH_EXCLUDE_JOBS = "dispatch-job|collect-logs|wait-for-summary"  # Same jobs index.js does not wait for
+
+HTTP_CACHE_DIR = os.getenv("HTTP_CACHE_DIR", os.path.expanduser("~/.cache/logs_summary_action/http"))
+METRICS_FILE = os.getenv("METRICS_FILE", "./script/metrics.jsonl")
+
+RUNS_PER_PAGE = 100
+BACKFILL_MAX_LISTED_RUNS = 1000  # GitHub's cap on results of a filtered run listing
+BACKFILL_RUN_WORKERS = 2  # Runs listed and analyzed at a time; their jobs share the --workers pool
+BACKFILL_MAX_ATTEMPTS = 3
+BACKFILL_DB = os.getenv("BACKFILL_DB", os.path.expanduser("~/.cache/logs_summary_action/backfill.db"))
+BACKFILL_OUTPUT_DIR = "./script/backfill"  # Analyses of each run go to a subdirectory named after it
+SPAN_COUNTERS = ["bytes", "tokens", "requests", "retries"]  # Summed per phase in the step summary table
+PROFILED_PHASES = {"list_runs", "list_jobs", "download_archive", "download", "excerpt", "tokenize", "analyze"}  # Never nested in one another
+PROFILE_TOP_ALLOCATIONS = 20
+PROFILE_TRACEBACK_FRAMES = 1  # Allocations are reported per line
+
+http_settings = {
+    "timeout": (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT),
+    "max_retries": HTTP_MAX_RETRIES
+}
+http_stats = {"requests": 0, "retries": 0, "rate_limit_waits": 0}
+http_lock = threading.Lock()
+http_sessions = {}
+rate_limit_resets = {}
+http_cache = None
+http_thread_stats = threading.local()
+spans = []
+span_lock = threading.Lock()
+span_context = threading.local()
+profile_settings = {"dir": None, "top": PROFILE_TOP_ALLOCATIONS}
+profile_lock = threading.Lock()
+cpu_settings = {"pool": None, "workers": 1}
+stream_settings = {
+    "enabled": False,
+    "first_byte_timeout": STREAM_FIRST_BYTE_TIMEOUT,
+    "total_timeout": STREAM_TOTAL_TIMEOUT
+}
+worker_tokenizer = None
+report_lock = threading.Lock()
+
+# Lines that usually point at the cause of a failed step: Actions error
+# annotations, Python tracebacks, test runner failures, non-zero exit codes
+# and compiler diagnostics (gcc/clang "file:line:col: error", msvc/tsc "error C1234:").
+FAILURE_MARKERS = re.compile(
+    r"##\[error\]"
+    r"|Traceback \(most recent call last\)"
+    r"|\bFAILED\b"
+    r"|(?:[Ee]rror|[Ff]atal|Exception):"
+    r"|npm ERR!"
+    r"|[Ee]xit (?:code|status) [1-9]"
+    r"|:\d+(?::\d+)?: (?:fatal )?error\b"
+    r"|\berror [A-Z]+\d+:"
+)
+FAILURE_MARKER_BYTES = re.compile(FAILURE_MARKERS.pattern.encode())
+# Every FAILURE_MARKERS alternative contains one of these literals.
+FAILURE_MARKER_LITERALS = [b"rror", b"atal", b"Exception:", b"FAILED", b"Traceback", b"npm ERR!", b"xit code", b"xit status"]
+
+# Lines that carry no diagnostic value: package download/install progress,
+# git transfer progress, npm chatter and progress bars.
+LOG_NOISE = re.compile(
+    r"\s*(?:Downloading|Collecting|Using cached|Requirement already satisfied|Obtaining|Stored in directory"
+    r"|Preparing metadata|Building wheel|Created wheel|Receiving objects|Resolving deltas|Unpacking objects"
+    r"|remote: (?:Enumerating|Counting|Compressing) objects|npm (?:http fetch|timing|sill|verb))\b"
+    r"|.*(?:[━█▓▒░■]{5,}|\[[=#>-]{10,}\])"
+)
+NEAR_DUPLICATE_DETAILS = re.compile(r"0x[0-9a-fA-F]+|[0-9a-f]{7,}|\d+")
+# Failure lines that every failing job prints, whatever failed: exit codes,
+# npm's lifecycle epilogue and Gradle's build failure banner.
+GENERIC_FAILURE_LINES = re.compile(
+    r"##\[error\]Process completed with exit code"
+    r"|^npm ERR! (?:code|errno|syscall|signal|path|command|Exit status|Failed at the|A complete log"
+    r"|This is probably not a problem|Lifecycle script|$)"
+    r"|^(?:Error: )?Command failed with exit code"
+    r"|^FAILURE: Build failed with an exception"
+    r"|^\* What went wrong:"
+)
+# Lines besides FAILURE_MARKERS that name what failed: the failing test,
+# the assertion and the expected and actual values.
+FAILURE_DETAILS = re.compile(r"\bFAIL|\b(?:[Ee]xpected|Received|assert)\b|(?:Error|Exception)\b|\bbut was\b")
+MAX_DROPPED_GROUP_LINES = 200  # Larger ##[group] blocks are kept, since they usually wrap real output
+
+def timed_import(module_name):
+    start = time.perf_counter()
+    module = importlib.import_module(module_name)
+    STARTUP_TIMINGS.append((f"import {module_name}", time.perf_counter() - start))
+    return module
+
+def get_requests():
+    global requests
+    if requests is None:
+        requests = timed_import("requests")
+    return requests
+
+class ApproximateTokenizer:
+    # Stand-in used when the BPE file is not cached locally: roughly four
+    # characters per token, which is close enough for sizing chunks.
+    CHARS_PER_TOKEN = 4
+
+    def encode(self, text):
+        return [text[i:i+self.CHARS_PER_TOKEN] for i in range(0, len(text), self.CHARS_PER_TOKEN)]
+
+    def decode(self, tokens):
+        return "".join(tokens)
+
+    def decode_tokens_bytes(self, tokens):
+        return [token.encode("utf-8") for token in tokens]
+
+def tokenizer_is_cached(cache_dir):
+    # tiktoken stores each BPE file under the SHA-1 of its download URL.
+    cache_key = hashlib.sha1(TOKENIZER_BLOB_URL.encode()).hexdigest()
+    return os.path.exists(os.path.join(cache_dir, cache_key))
+
+def load_tokenizer(cache_dir=TOKENIZER_CACHE_DIR, allow_download=False, quiet=False):
+    start = time.perf_counter()
+    if not allow_download and not tokenizer_is_cached(cache_dir):
+        if not quiet:
+            print(f"Tokenizer cache not found in {cache_dir}; using approximate token counts. "
+                  "Run with --warm-tokenizer-cache once to populate it.")
+        tokenizer = ApproximateTokenizer()
+    else:
+        os.environ["TIKTOKEN_CACHE_DIR"] = cache_dir
+        tiktoken = timed_import("tiktoken")  # OpenAI's tokenizer package
+        tokenizer = tiktoken.get_encoding(TOKENIZER_ENCODING)
+    STARTUP_TIMINGS.append(("load tokenizer", time.perf_counter() - start))
+    return tokenizer
+
+def print_startup_report():
+    print("Startup report:")
+    for name, seconds in STARTUP_TIMINGS:
+        print(f"  {name}: {seconds * 1000:.1f} ms")
+    print(f"  total since process start: {(time.perf_counter() - PROCESS_START) * 1000:.1f} ms")
+
+@contextmanager
+def span(name, **fields):
+    # Times one phase of the pipeline for the job this thread is analyzing.
+    # The body adds counters such as bytes or tokens to the yielded record;
+    # HTTP requests and retries made by this thread are added automatically.
+    record = {"name": name, "job": getattr(span_context, "job", None), **fields}
+    requests_before = getattr(http_thread_stats, "requests", 0)
+    retries_before = getattr(http_thread_stats, "retries", 0)
+    start = time.perf_counter()
+    try:
+        if profile_settings["dir"] and name in PROFILED_PHASES:
+            with profile_phase(name, record["job"]):
+                yield record
+        else:
+            yield record
+    except Exception as e:
+        record["error"] = str(e)
+        raise
+    finally:
+        record["start"] = round(start - PROCESS_START, 6)
+        record["seconds"] = round(time.perf_counter() - start, 6)
+        record["requests"] = getattr(http_thread_stats, "requests", 0) - requests_before
+        record["retries"] = getattr(http_thread_stats, "retries", 0) - retries_before
+        with span_lock:
+            spans.append(record)
+
+@contextmanager
+def profile_phase(name, job_name):
+    # --profile: runs the phase under cProfile and tracemalloc, which only
+    # traces while the phase runs, so its report holds the phase's peak and
+    # the allocations it left behind. Profiled phases run one at a time, as
+    # Python 3.12 allows one cProfile profiler per process and tracemalloc
+    # cannot tell threads apart; timings in the metrics include that wait.
+    cProfile = sys.modules["cProfile"]  # Both imported by main() for --profile
+    tracemalloc = sys.modules["tracemalloc"]
+    prefix = ARCHIVE_UNSAFE_CHARS.sub("_", job_name or "run").replace(" ", "_")
+    with profile_lock:
+        tracemalloc.start(PROFILE_TRACEBACK_FRAMES)
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            snapshot = tracemalloc.take_snapshot()
+            retained, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            profiler.dump_stats(os.path.join(profile_settings["dir"], f"{prefix}_{name}.pstats"))
+            statistics = snapshot.statistics("lineno")
+            with open(os.path.join(profile_settings["dir"], f"{prefix}_allocations.txt"), 'a') as report:
+                report.write(f"== {name}: peak {peak / 1024:.1f} KiB, retained {retained / 1024:.1f} KiB\n")
+                for statistic in statistics[:profile_settings["top"]]:
+                    report.write(f"{statistic}\n")
+                report.write("\n")
+
+def write_metrics(metrics_filename):
+    with span_lock:
+        records = list(spans)
+    if not records:
+        return
+    os.makedirs(os.path.dirname(os.path.abspath(metrics_filename)), exist_ok=True)
+    with open(metrics_filename, 'w') as metrics_file:
+        for record in records:
+            metrics_file.write(json.dumps(record) + "\n")
+    print(f"Metrics saved to {metrics_filename}")
+
+    # Phases run concurrently across jobs, so the total of a phase can exceed
+    # the run's wall time; the slowest single span is shown next to it.
+    phases = {}
+    for record in records:
+        phase = phases.setdefault(record["name"], {"count": 0, "seconds": 0.0, "max": 0.0, "errors": 0,
+                                                   **{counter: 0 for counter in SPAN_COUNTERS}})
+        phase["count"] += 1
+        phase["seconds"] += record["seconds"]
+        phase["max"] = max(phase["max"], record["seconds"])
+        phase["errors"] += "error" in record
+        for counter in SPAN_COUNTERS:
+            phase[counter] += record.get(counter) or 0
+    rows = ["| Phase | Count | Total s | Max s | Bytes | Tokens | Requests | Retries | Errors |",
+            "|---|---:|---:|---:|---:|---:|---:|---:|---:|"]
+    for name, phase in phases.items():
+        rows.append(f"| {name} | {phase['count']} | {phase['seconds']:.2f} | {phase['max']:.2f} | {phase['bytes']} | "
+                    f"{phase['tokens']} | {phase['requests']} | {phase['retries']} | {phase['errors']} |")
+    step_summary = os.getenv("GITHUB_STEP_SUMMARY")
+    if step_summary:
+        with open(step_summary, 'a') as summary_file:
+            summary_file.write("### Log analysis timings\n\n" + "\n".join(rows) + "\n\n")
+    else:
+        print("\n".join(rows))
+
+def get_session(url):
+    # One pooled session per host, shared by every thread, so requests to
+    # the same host reuse their TLS connections.
+    host = urlsplit(url).netloc
+    with http_lock:
+        session = http_sessions.get(host)
+        if session is None:
+            requests = get_requests()
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=HTTP_POOL_SIZE)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            http_sessions[host] = session
+    return session
+
+def count_http(stat, amount=1):
+    with http_lock:
+        http_stats[stat] += amount
+    # Per-thread counts let span() attribute requests and retries to a phase.
+    setattr(http_thread_stats, stat, getattr(http_thread_stats, stat, 0) + amount)
+
+def backoff_delay(attempt):
+    return random.uniform(0, min(HTTP_BACKOFF_MAX, HTTP_BACKOFF_BASE * 2 ** attempt))
+
+def retry_after_seconds(response):
+    retry_after = response.headers.get("Retry-After")
+    if not retry_after:
+        return None
+    if retry_after.isdigit():
+        return int(retry_after)
+    try:
+        return max(0, parsedate_to_datetime(retry_after).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+def rate_limit_reset_seconds(response):
+    if response.headers.get("X-RateLimit-Remaining") != "0":
+        return None
+    reset = response.headers.get("X-RateLimit-Reset")
+    if not reset or not reset.isdigit():
+        return None
+    return max(0, int(reset) - time.time()) + 1
+
+def retry_delay(response, attempt):
+    # GitHub signals primary and secondary rate limits with 403 or 429 plus
+    # Retry-After or X-RateLimit-Remaining: 0; other 5xx errors are retried
+    # with exponential backoff. A secondary rate limit may also come as a
+    # bare 403 that only says so in its body.
+    rate_limited = response.status_code in (403, 429) and (
+        "Retry-After" in response.headers or response.headers.get("X-RateLimit-Remaining") == "0"
+    )
+    secondary_rate_limited = (response.status_code == 403 and not rate_limited
+                              and "secondary rate limit" in response.text.lower())
+    if not rate_limited and not secondary_rate_limited and response.status_code not in RETRY_STATUS_CODES:
+        return None
+    delay = retry_after_seconds(response)
+    if delay is None:
+        delay = rate_limit_reset_seconds(response)
+    if delay is None and secondary_rate_limited:
+        # At least a minute, then exponentially longer.
+        return min(HTTP_SECONDARY_RATE_LIMIT_WAIT * 2 ** attempt, HTTP_MAX_RATE_LIMIT_WAIT)
+    if delay is None:
+        return backoff_delay(attempt)
+    return delay if delay <= HTTP_MAX_RATE_LIMIT_WAIT else None
+
+def wait_for_rate_limit(host):
+    with http_lock:
+        reset_at = rate_limit_resets.get(host, 0)
+    delay = reset_at - time.time()
+    if delay > 0:
+        print(f"Rate limit exhausted for {host}; waiting {delay:.0f}s for it to reset")
+        count_http("rate_limit_waits")
+        time.sleep(min(delay, HTTP_MAX_RATE_LIMIT_WAIT))
+
+def http_request(method, url, **kwargs):
+    requests = get_requests()
+    kwargs.setdefault("timeout", http_settings["timeout"])
+    session = get_session(url)
+    host = urlsplit(url).netloc
+    max_retries = http_settings["max_retries"]
+    for attempt in range(max_retries + 1):
+        wait_for_rate_limit(host)
+        count_http("requests")
+        try:
+            response = session.request(method, url, **kwargs)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            if attempt == max_retries:
+                raise
+            delay = backoff_delay(attempt)
+            print(f"{method} {url} failed ({e}); retrying in {delay:.1f}s")
+        else:
+            reset_delay = rate_limit_reset_seconds(response)
+            if reset_delay is not None:
+                with http_lock:
+                    rate_limit_resets[host] = time.time() + reset_delay
+            delay = retry_delay(response, attempt)
+            if delay is None or attempt == max_retries:
+                return response
+            print(f"{method} {url} returned {response.status_code}; retrying in {delay:.1f}s")
+            response.close()
+        count_http("retries")
+        time.sleep(delay)
+
+def http_connection_stats():
+    # urllib3 counts connections opened and requests sent per pool; every
+    # request beyond the first on a connection reused it.
+    connections = 0
+    requests_sent = 0
+    with http_lock:
+        sessions = list(http_sessions.values())
+    for session in sessions:
+        for adapter in set(session.adapters.values()):
+            pools = adapter.poolmanager.pools
+            for key in list(pools.keys()):
+                pool = pools.get(key)
+                if pool is not None:
+                    connections += pool.num_connections
+                    requests_sent += pool.num_requests
+    return connections, max(0, requests_sent - connections)
+
+def print_http_stats():
+    connections, reused = http_connection_stats()
+    print(f"HTTP: {http_stats['requests']} requests, {http_stats['retries']} retries, "
+          f"{http_stats['rate_limit_waits']} rate limit waits, "
+          f"{connections} connections opened, {reused} connection reuses")
+    if http_cache:
+        print(f"HTTP cache: {http_cache.hits} not-modified responses served from disk, {http_cache.misses} full responses")
+
+class HttpCache:
+    # Conditional-request cache for GitHub API reads: stores each response
+    # body with its ETag/Last-Modified, and serves it again when GitHub
+    # answers 304 Not Modified (which does not count against the rate limit).
+    def __init__(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def key_for(url, params, headers):
+        query = urlencode(sorted((params or {}).items()))
+        return hashlib.sha256(f"{url}?{query} {headers.get('Accept', '')}".encode()).hexdigest()
+
+    def paths(self, key):
+        return os.path.join(self.directory, f"{key}.json"), os.path.join(self.directory, f"{key}.body")
+
+    def conditional_headers(self, key):
+        meta_path, body_path = self.paths(key)
+        if not os.path.exists(meta_path) or not os.path.exists(body_path):
+            return {}
+        with open(meta_path) as meta_file:
+            meta = json.load(meta_file)
+        headers = {}
+        if meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+        return headers
+
+    def load(self, key):
+        _, body_path = self.paths(key)
+        try:
+            with open(body_path, 'rb') as body_file:
+                body = body_file.read()
+        except FileNotFoundError:
+            return None
+        with self.lock:
+            self.hits += 1
+        return body
+
+    def store(self, key, response):
+        with self.lock:
+            self.misses += 1
+        etag = response.headers.get("ETag")
+        last_modified = response.headers.get("Last-Modified")
+        if not etag and not last_modified:
+            return
+        meta_path, body_path = self.paths(key)
+        # Write to temporary files and rename so concurrent readers never see
+        # a partially written entry.
+        suffix = f".{threading.get_ident()}.tmp"
+        with open(body_path + suffix, 'wb') as body_file:
+            body_file.write(response.content)
+        with open(meta_path + suffix, 'w') as meta_file:
+            json.dump({"url": response.url, "etag": etag, "last_modified": last_modified}, meta_file)
+        os.replace(body_path + suffix, body_path)
+        os.replace(meta_path + suffix, meta_path)
+
+def http_get_json(url, headers, params=None):
+    if http_cache is None:
+        response = http_request("GET", url, headers=headers, params=params)
+        response.raise_for_status()
+        return response.json()
+
+    key = http_cache.key_for(url, params, headers)
+    conditional_headers = http_cache.conditional_headers(key)
+    response = http_request("GET", url, headers={**headers, **conditional_headers}, params=params)
+    if response.status_code == 304:
+        body = http_cache.load(key)
+        if body is not None:
+            return json.loads(body)
+        response = http_request("GET", url, headers=headers, params=params)
+    response.raise_for_status()
+    http_cache.store(key, response)
+    return response.json()
 
-def chunk_text_by_tokens(text, max_tokens, tokenizer):
-    tokens = tokenizer.encode(text)
-    token_chunks = [tokens[i:i+max_tokens] for i in range(0, len(tokens), max_tokens)]
-    return [tokenizer.decode(chunk) for chunk in token_chunks]
+def split_line_by_tokens(line, line_tokens, max_tokens, tokenizer):
+    # Only a single line longer than max_tokens is split mid-line; its pieces
+    # are cut on token boundaries.
+    return [tokenizer.decode(line_tokens[i:i+max_tokens]) for i in range(0, len(line_tokens), max_tokens)]
 
-def get_failed_steps(owner, repo, run_id, headers):
-    url = f"https://api.github.com/repos/{owner}/{repo}/actions/runs/{run_id}/jobs"
-    response = requests.get(url, headers=headers)
-    response.raise_for_status()
-    jobs = response.json()["jobs"]
+def chunk_text_by_tokens(text, max_tokens, tokenizer):
+    # Chunks end on line breaks and tokens are counted one line at a time,
+    # so the whole text is never held as a single token list. Returns the
+    # chunks and the total token count.
+    chunks = []
+    chunk_lines = []
+    chunk_tokens = 0
+    total_tokens = 0
+    for line in text.splitlines(keepends=True):
+        line_tokens = tokenizer.encode(line)
+        total_tokens += len(line_tokens)
+        if chunk_lines and chunk_tokens + len(line_tokens) > max_tokens:
+            chunks.append("".join(chunk_lines))
+            chunk_lines = []
+            chunk_tokens = 0
+        if len(line_tokens) > max_tokens:
+            chunks.extend(split_line_by_tokens(line, line_tokens, max_tokens, tokenizer))
+            continue
+        chunk_lines.append(line)
+        chunk_tokens += len(line_tokens)
+    if chunk_lines:
+        chunks.append("".join(chunk_lines))
+    return chunks, total_tokens
+
+def iter_text_lines(text):
+    # Lines of text with their line breaks, without building a list of them.
+    start = 0
+    while start < len(text):
+        end = text.find("\n", start) + 1 or len(text)
+        yield text[start:end]
+        start = end
+
+def count_tokens(text, tokenizer):
+    # The approximate count needs no token list.
+    if isinstance(tokenizer, ApproximateTokenizer):
+        return -(-len(text) // ApproximateTokenizer.CHARS_PER_TOKEN)
+    return len(tokenizer.encode(text))
+
+def counting_tokens(lines, tokenizer, counts, name):
+    # Passes lines through while adding their tokens to counts[name]; like
+    # chunk_text_by_tokens(), one line is encoded at a time.
+    for line in lines:
+        counts[name] += count_tokens(line, tokenizer)
+        yield line
+
+def iter_token_chunk_offsets(log_filename, max_tokens, tokenizer, start=0, end=None):
+    # Streaming variant of chunk_text_by_tokens() for whole log files: yields
+    # (start, end) byte offsets of each chunk instead of the chunk text, so
+    # memory stays flat regardless of log size. start and end limit it to one
+    # partition of an uncompressed log.
+    offset = start
+    chunk_tokens = 0
+    open_file = gzip.open if log_filename.endswith(".gz") else open
+    with open_file(log_filename, 'rb') as file:
+        file.seek(start)
+        for raw_line in file:
+            if end is not None and offset >= end:
+                break
+            line_tokens = tokenizer.encode(raw_line.decode('utf-8', errors='replace'))
+            if chunk_tokens and chunk_tokens + len(line_tokens) > max_tokens:
+                yield start, offset
+                start = offset
+                chunk_tokens = 0
+            if len(line_tokens) > max_tokens:
+                token_lengths = [len(token_bytes) for token_bytes in tokenizer.decode_tokens_bytes(line_tokens)]
+                if sum(token_lengths) == len(raw_line):
+                    for i in range(0, len(token_lengths), max_tokens):
+                        piece_length = sum(token_lengths[i:i+max_tokens])
+                        yield offset, offset + piece_length
+                        offset += piece_length
+                    start = offset
+                    continue
+            chunk_tokens += len(line_tokens)
+            offset += len(raw_line)
+    if offset > start:
+        yield start, offset
+
+def init_cpu_worker(cache_dir):
+    # The parent already said which tokenizer it uses.
+    global worker_tokenizer
+    worker_tokenizer = load_tokenizer(cache_dir, quiet=True)
+
+def token_chunk_offsets_partition(log_filename, max_tokens, start, end):
+    # Runs in a --cpu-workers process with that process's own tokenizer.
+    return list(iter_token_chunk_offsets(log_filename, max_tokens, worker_tokenizer, start, end))
+
+def log_partitions(log_filename, parts):
+    # Splits an uncompressed log into about `parts` byte ranges, each
+    # starting at the beginning of a line.
+    size = os.path.getsize(log_filename)
+    bounds = [0]
+    with open(log_filename, 'rb') as file:
+        for i in range(1, parts):
+            file.seek(max(bounds[-1], size * i // parts))
+            file.readline()
+            if file.tell() >= size:
+                break
+            bounds.append(file.tell())
+    bounds.append(size)
+    return list(zip(bounds, bounds[1:]))
+
+def use_cpu_pool(log_filename):
+    return (cpu_settings["pool"] is not None and not log_filename.endswith(".gz")
+            and os.path.getsize(log_filename) >= CPU_PARTITION_MIN_MB * 1024 * 1024)
+
+def token_chunk_offsets(log_filename, max_tokens, tokenizer):
+    # With --cpu-workers, large logs are tokenized one partition per worker
+    # process and the chunk offsets merged in order. A chunk never spans two
+    # partitions, so there can be one short chunk per partition boundary.
+    if not use_cpu_pool(log_filename):
+        return list(iter_token_chunk_offsets(log_filename, max_tokens, tokenizer))
+    starts, ends = zip(*log_partitions(log_filename, cpu_settings["workers"]))
+    chunk_offsets = []
+    for partition_offsets in cpu_settings["pool"].map(
+            token_chunk_offsets_partition, [log_filename] * len(starts), [max_tokens] * len(starts), starts, ends):
+        chunk_offsets.extend(partition_offsets)
+    return chunk_offsets
+
+def read_log_chunk(log_filename, start, end):
+    open_file = gzip.open if log_filename.endswith(".gz") else open
+    with open_file(log_filename, 'rb') as file:
+        file.seek(start)
+        return file.read(end - start).decode('utf-8', errors='replace')
+
+def get_jobs_page(url, headers, params, page):
+    return http_get_json(url, headers, {**params, "page": page})
+
+def list_run_jobs(owner, repo, run_id, headers, job_filter="latest", attempt=None):
+    if attempt:
+        url = f"{GITHUB_API_URL}/repos/{owner}/{repo}/actions/runs/{run_id}/attempts/{attempt}/jobs"
+        params = {"per_page": JOBS_PER_PAGE}
+    else:
+        url = f"{GITHUB_API_URL}/repos/{owner}/{repo}/actions/runs/{run_id}/jobs"
+        params = {"per_page": JOBS_PER_PAGE, "filter": job_filter}
+
+    # The first page tells us how many jobs the run has; the remaining pages
+    # are then fetched concurrently instead of one round-trip after another.
+    first_page = get_jobs_page(url, headers, params, 1)
+    jobs = first_page["jobs"]
+    page_count = math.ceil(first_page["total_count"] / JOBS_PER_PAGE)
+    if page_count > 1:
+        remaining_pages = range(2, page_count + 1)
+        with ThreadPoolExecutor(max_workers=min(len(remaining_pages), MAX_PAGE_WORKERS)) as executor:
+            for page in executor.map(lambda page: get_jobs_page(url, headers, params, page), remaining_pages):
+                jobs.extend(page["jobs"])
+    return jobs
+
+def get_failed_steps(owner, repo, run_id, headers, job_filter="latest", attempt=None):
+    jobs = list_run_jobs(owner, repo, run_id, headers, job_filter, attempt)
+    return failed_steps_from_jobs(owner, repo, jobs)
+
+def failed_steps_from_jobs(owner, repo, jobs):
     failed_steps = []
     for job in jobs:
-        job_logs_url = f"https://api.github.com/repos/{owner}/{repo}/actions/jobs/{job['id']}/logs"
+        job_logs_url = f"{GITHUB_API_URL}/repos/{owner}/{repo}/actions/jobs/{job['id']}/logs"
         for step in job["steps"]:
             if step["conclusion"] == "failure":
                 failed_steps.append({
+                    "job_id": job["id"],
                     "job_name": job["name"],
                     "step_name": step["name"],
+                    "step_number": step["number"],
+                    "step_started_at": step.get("started_at"),
+                    "step_completed_at": step.get("completed_at"),
                     "job_logs_url": job_logs_url
                 })
     return failed_steps
 
-def download_logs(logs_url, headers, output_filename):
-    response = requests.get(logs_url, headers=headers)
-    response.raise_for_status()
-    if not response.content:
+def group_failed_steps_by_job(failed_steps):
+    # Every failed step of a job points at the same job log, so it is fetched
+    # and analyzed once per job rather than once per step.
+    failed_jobs = {}
+    for step in failed_steps:
+        job = failed_jobs.setdefault(step["job_id"], {
+            "job_id": step["job_id"],
+            "job_name": step["job_name"],
+            "job_logs_url": step["job_logs_url"],
+            "step_names": [],
+            "step_numbers": [],
+            "step_times": []
+        })
+        job["step_names"].append(step["step_name"])
+        job["step_numbers"].append(step["step_number"])
+        job["step_times"].append((step["step_started_at"], step["step_completed_at"]))
+    return list(failed_jobs.values())
+
+def download_run_log_archive(owner, repo, run_id, headers, attempt=None, output_dir=None):
+    # One zip holds the per-step logs of every job in the run, so a run with
+    # many failed jobs needs a single download instead of one per job. It is
+    # written next to the job logs and removed once they are extracted.
+    if attempt:
+        url = f"{GITHUB_API_URL}/repos/{owner}/{repo}/actions/runs/{run_id}/attempts/{attempt}/logs"
+    else:
+        url = f"{GITHUB_API_URL}/repos/{owner}/{repo}/actions/runs/{run_id}/logs"
+    timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
+    archive_filename = f"run_{run_id}_logs_{timestamp}.zip"
+    if output_dir:
+        archive_filename = os.path.join(output_dir, archive_filename)
+    download_logs(url, headers, archive_filename)
+    return archive_filename
+
+def archive_entry_name(name):
+    return ARCHIVE_UNSAFE_CHARS.sub("", name).strip()
+
+def extract_job_log_from_archive(archive_filename, job, output_filename, compress=False):
+    # The archive holds "<job name>/<step number>_<step name>.txt" for every
+    # step; only the failed steps of this job are read, straight from the zip
+    # without extracting anything else.
+    job_entry = archive_entry_name(job["job_name"])
+    with zipfile.ZipFile(archive_filename) as archive:
+        members = []
+        for step_number in job["step_numbers"]:
+            for member in archive.namelist():
+                directory, _, filename = member.partition("/")
+                if filename and archive_entry_name(directory) == job_entry and filename.startswith(f"{step_number}_"):
+                    members.append(member)
+        if not members:
+            # Fall back to the whole job log stored as "<n>_<job name>.txt".
+            members = [
+                member for member in archive.namelist()
+                if "/" not in member and re.fullmatch(rf"\d+_{re.escape(job_entry)}\.txt", member)
+            ]
+        if not members:
+            raise Exception(f"No logs for {job['job_name']} found in {archive_filename}")
+
+        open_file = gzip.open if compress else open
+        with open_file(output_filename, 'wb') as output:
+            for member in members:
+                with archive.open(member) as source:
+                    shutil.copyfileobj(source, output, DOWNLOAD_CHUNK_SIZE)
+    return True
+
+def watch_failed_jobs(owner, repo, run_id, headers, args):
+    # Poll the run until every job (other than the excluded ones, such as
+    # the job running this script) has completed, yielding each failed job
+    # as soon as it finishes. The poll interval starts at
+    # --watch-min-interval, grows while nothing changes and drops back as
+    # soon as a job changes status. Repeated polls are cheap thanks to the
+    # ETag cache.
+    exclude = re.compile(args.watch_exclude) if args.watch_exclude else None
+    deadline = time.monotonic() + args.watch_timeout
+    interval = args.watch_min_interval
+    previous_statuses = None
+    seen_failures = set()
+    while True:
+        jobs = list_run_jobs(owner, repo, run_id, headers, args.filter, args.attempt)
+        jobs = [job for job in jobs if not (exclude and exclude.search(job["name"]))]
+
+        newly_failed = [
+            job for job in jobs
+            if job["status"] == "completed" and job["conclusion"] == "failure" and job["id"] not in seen_failures
+        ]
+        seen_failures.update(job["id"] for job in newly_failed)
+        yield from group_failed_steps_by_job(failed_steps_from_jobs(owner, repo, newly_failed))
+
+        pending = [job["name"] for job in jobs if job["status"] != "completed"]
+        if not pending:
+            print("All watched jobs have completed.")
+            return
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            print(f"Stopped watching after {args.watch_timeout}s; still running: {', '.join(pending)}")
+            return
+
+        statuses = {job["id"]: job["status"] for job in jobs}
+        if previous_statuses is not None and statuses == previous_statuses:
+            interval = min(interval * WATCH_BACKOFF_FACTOR, args.watch_max_interval)
+        else:
+            interval = args.watch_min_interval
+        previous_statuses = statuses
+        print(f"Waiting for {len(pending)} jobs ({', '.join(pending[:5])}{', ...' if len(pending) > 5 else ''}); next check in {interval:.0f}s")
+        time.sleep(min(interval, remaining))
+
+def download_logs(logs_url, headers, output_filename, compress=False, chunk_size=DOWNLOAD_CHUNK_SIZE):
+    # Stream the log to disk in fixed-size chunks so only one chunk is held
+    # in memory, however large the job log is.
+    bytes_written = 0
+    with http_request("GET", logs_url, headers=headers, stream=True) as response:
+        response.raise_for_status()
+        open_file = gzip.open if compress else open
+        with open_file(output_filename, 'wb') as file:
+            for chunk in response.iter_content(chunk_size=chunk_size):
+                file.write(chunk)
+                bytes_written += len(chunk)
+    if not bytes_written:
+        os.remove(output_filename)
         raise Exception("Received empty content from GitHub API.")
-    with open(output_filename, 'wb') as file:  # Fixed the syntax error here
-        file.write(response.content)
     return True
 
-def analyze_logs_with_custom_service(log_chunks, tokenizer):
-    url = "https://www.dex.inside.philips.com/philips-ai-chat/chat/api/user/SendImageMessage"
+def fetch_log_range(blob_url, byte_range):
+    # Returns the bytes and the full size of the log from the Content-Range
+    # header, or (None, None) when the server did not answer with the range:
+    # its body, possibly the whole log, is then left unread.
+    with http_request("GET", blob_url, headers={"Range": f"bytes={byte_range}"}, stream=True) as response:
+        if response.status_code != 416:  # An empty log has no byte 0
+            response.raise_for_status()
+        total_size = response.headers.get("Content-Range", "").rpartition("/")[2]
+        if response.status_code != 206 or not total_size.isdigit():
+            return None, None
+        return response.content, int(total_size)
+
+def download_log_tail(logs_url, headers, output_filename, compress=False,
+                      tail_bytes=TAIL_FETCH_MB * 1024 * 1024, max_bytes=MAX_LOG_MEMORY_MB * 1024 * 1024):
+    # The logs endpoint redirects to blob storage, which serves byte ranges.
+    # Fetch only the last tail_bytes, and double the range backwards until it
+    # holds a specific failure marker, reaches the start of the log or exceeds
+    # max_bytes.
+    # The size is learned from a one-byte range first, so only explicit ranges
+    # are requested; if blob storage does not serve them, the whole log is
+    # streamed to disk instead.
+    with http_request("GET", logs_url, headers=headers, allow_redirects=False, stream=True) as response:
+        response.raise_for_status()
+        blob_url = response.headers.get("Location") if response.is_redirect else None
+    if not blob_url:
+        return download_logs(logs_url, headers, output_filename, compress)
+
+    _, total_size = fetch_log_range(blob_url, "0-0")
+    if not total_size:
+        return download_logs(logs_url, headers, output_filename, compress)
+    start = max(0, total_size - tail_bytes)
+    piece, _ = fetch_log_range(blob_url, f"{start}-{total_size - 1}")
+    if piece is None:
+        return download_logs(logs_url, headers, output_filename, compress)
+    # Unless the range reaches the start of the log, its first line is
+    # partial: it is only searched once the next range completes it.
+    pieces = deque([piece if start == 0 else piece[piece.find(b"\n") + 1:]])
+    partial = b"" if start == 0 else piece[:piece.find(b"\n") + 1]
+    found = has_specific_failure(pieces[0])
+    while start > 0 and not found and total_size - start < max_bytes:
+        size = min(start, max(total_size - start, tail_bytes))
+        piece, _ = fetch_log_range(blob_url, f"{start - size}-{start - 1}")
+        if piece is None:
+            return download_logs(logs_url, headers, output_filename, compress)
+        start -= len(piece)
+        piece += partial
+        partial = b"" if start == 0 else piece[:piece.find(b"\n") + 1]
+        pieces.appendleft(piece[len(partial):])
+        found = has_specific_failure(pieces[0])
+
+    if start > 0:
+        print(f"Fetched the last {total_size - start} of {total_size} bytes for {output_filename}")
+    bytes_written = 0
+    open_file = gzip.open if compress else open
+    with open_file(output_filename, 'wb') as file:
+        for piece in pieces:
+            file.write(piece)
+            bytes_written += len(piece)
+    if not bytes_written:
+        os.remove(output_filename)
+        raise Exception("Received empty content from GitHub API.")
+    return True
+
+def open_log(log_filename):
+    if log_filename.endswith(".gz"):
+        return gzip.open(log_filename, 'rt', errors='replace')
+    return open(log_filename, 'r', errors='replace')
+
+def read_log_tail(log_filename, max_chars):
+    # Failures are reported at the end of a job log, so when the log is larger
+    # than the memory ceiling only its last max_chars characters are kept.
+    lines = deque()
+    kept_chars = 0
+    with open_log(log_filename) as file:
+        for line in file:
+            lines.append(line)
+            kept_chars += len(line)
+            while kept_chars > max_chars and len(lines) > 1:
+                kept_chars -= len(lines.popleft())
+    return "".join(lines)
+
+def extract_failure_windows(lines, before, after, max_chars):
+    # Single pass over the log: a bounded deque remembers the last `before`
+    # lines, and each failure marker opens (or extends) a window that stays
+    # open for `after` more lines. Windows that touch are merged.
+    windows = deque()
+    previous = deque(maxlen=before)
+    window = None
+    remaining_after = 0
+    lines_since_window = None
+    kept_chars = 0
+    for line in lines:
+        if FAILURE_MARKERS.search(line):
+            if window is None:
+                if windows and lines_since_window is not None and lines_since_window <= before:
+                    window = windows[-1]
+                else:
+                    window = deque()
+                    windows.append(window)
+                window.extend(previous)
+                kept_chars += sum(len(previous_line) for previous_line in previous)
+                previous.clear()
+            window.append(line)
+            kept_chars += len(line)
+            remaining_after = after
+        elif window is not None and remaining_after > 0:
+            window.append(line)
+            kept_chars += len(line)
+            remaining_after -= 1
+        else:
+            if window is not None:
+                window = None
+                lines_since_window = 0
+            previous.append(line)
+            if lines_since_window is not None:
+                lines_since_window += 1
+        # Like read_log_tail(), keep the most recent text when the extracted
+        # windows would exceed the memory ceiling.
+        while kept_chars > max_chars:
+            if len(windows) > 1:
+                kept_chars -= sum(len(window_line) for window_line in windows.popleft())
+            elif len(windows[0]) > 1:
+                kept_chars -= len(windows[0].popleft())
+            else:
+                break
+    return list(windows)
+
+def format_failure_windows(windows):
+    return FAILURE_WINDOW_SEPARATOR.join("".join(window) for window in windows)
+
+def find_marker_offsets(buffer, start, end):
+    # The first failure marker offset of each line between start (a line
+    # start) and end. Scanning with the marker regex costs about 0.2s/MB, as
+    # its alternatives defeat the regex engine's prefix search, while
+    # bytes.find runs at memory speed: only lines holding one of the marker
+    # literals are checked with the regex.
+    candidate_lines = set()
+    for literal in FAILURE_MARKER_LITERALS:
+        position = buffer.find(literal, start, end)
+        while position != -1:
+            candidate_lines.add(max(start, buffer.rfind(b"\n", start, position) + 1))
+            line_end = buffer.find(b"\n", position, end)
+            position = -1 if line_end == -1 else buffer.find(literal, line_end, end)
+    offsets = []
+    for line_start in sorted(candidate_lines):
+        line_end = buffer.find(b"\n", line_start, end)
+        match = FAILURE_MARKER_BYTES.search(buffer, line_start, end if line_end == -1 else line_end)
+        if match:
+            offsets.append(match.start())
+    return offsets
+
+def has_specific_failure(buffer):
+    # Whether buffer holds a failure marker line other than the generic ones
+    # every failing job ends with, such as the failed step's exit code.
+    for offset in find_marker_offsets(buffer, 0, len(buffer)):
+        line_end = buffer.find(b"\n", offset)
+        line = buffer[buffer.rfind(b"\n", 0, offset) + 1:len(buffer) if line_end == -1 else line_end]
+        line = ANSI_ESCAPE.sub("", ACTIONS_TIMESTAMP.sub("", line.decode("utf-8", "replace"))).strip()
+        if not GENERIC_FAILURE_LINES.search(line):
+            return True
+    return False
+
+def scan_log_partition(log_filename, start, end):
+    # Runs in a --cpu-workers process: the line starts and failure marker
+    # offsets of one partition, as arrays so they pickle compactly.
+    line_starts = array('Q')
+    marker_offsets = array('Q')
+    with open(log_filename, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+        position = buffer.find(b"\n", start, end)
+        while position != -1:
+            line_starts.append(position + 1)
+            position = buffer.find(b"\n", position + 1, end)
+        marker_offsets.extend(find_marker_offsets(buffer, start, end))
+    return line_starts, marker_offsets
+
+class LogIndex:
+    # Memory-maps an uncompressed log and records the byte offset where each
+    # line starts, in one pass, in a compact array. Marker scanning runs as a
+    # bytes regex over the mapped buffer and line windows are sliced out of
+    # it, so only the text that is actually sent is ever copied.
+    def __init__(self, log_filename):
+        self.file = open(log_filename, 'rb')
+        self.size = os.fstat(self.file.fileno()).st_size
+        self.buffer = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if self.size else b""
+        self.line_starts = array('Q', [0])
+        self.marker_offsets = None
+        if use_cpu_pool(log_filename):
+            self.scan_partitions(log_filename)
+            return
+        position = self.buffer.find(b"\n")
+        while position != -1 and position + 1 < self.size:
+            self.line_starts.append(position + 1)
+            position = self.buffer.find(b"\n", position + 1)
+
+    def scan_partitions(self, log_filename):
+        # Lines and markers of each partition are found in parallel by the
+        # --cpu-workers pool and merged in order. Markers never span lines, so
+        # splitting on line boundaries finds the same ones as a single scan.
+        self.marker_offsets = array('Q')
+        starts, ends = zip(*log_partitions(log_filename, cpu_settings["workers"]))
+        for line_starts, marker_offsets in cpu_settings["pool"].map(
+                scan_log_partition, [log_filename] * len(starts), starts, ends):
+            self.line_starts.extend(line_starts)
+            self.marker_offsets.extend(marker_offsets)
+        if self.line_starts[-1] == self.size:
+            self.line_starts.pop()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        if self.size:
+            self.buffer.close()
+        self.file.close()
+
+    def __len__(self):
+        return len(self.line_starts) if self.size else 0
+
+    def line_at(self, offset):
+        return bisect.bisect_right(self.line_starts, offset) - 1
+
+    def span(self, first_line, last_line):
+        end = self.line_starts[last_line + 1] if last_line + 1 < len(self.line_starts) else self.size
+        return self.line_starts[first_line], end
+
+    def text(self, first_line, last_line):
+        start, end = self.span(first_line, last_line)
+        with memoryview(self.buffer)[start:end] as window:
+            return str(window, 'utf-8', errors='replace')
+
+    def marker_offsets_between(self, pattern, start, end):
+        if self.marker_offsets is not None and pattern is FAILURE_MARKER_BYTES:
+            return self.marker_offsets[bisect.bisect_left(self.marker_offsets, start):bisect.bisect_left(self.marker_offsets, end)]
+        if pattern is FAILURE_MARKER_BYTES:
+            return find_marker_offsets(self.buffer, start, end)
+        return (match.start() for match in pattern.finditer(self.buffer, start, end))
+
+    def marker_lines(self, pattern=FAILURE_MARKER_BYTES, start=0, end=None):
+        lines = []
+        for offset in self.marker_offsets_between(pattern, start, self.size if end is None else end):
+            line = self.line_at(offset)
+            if not lines or lines[-1] != line:
+                lines.append(line)
+        return lines
+
+    def timestamp_at(self, line):
+        start = self.line_starts[line]
+        prefix = self.buffer[start:start + ACTIONS_TIMESTAMP_LENGTH]
+        return prefix.decode('ascii') if ACTIONS_TIMESTAMP_BYTES.match(prefix) else ""
+
+    def step_line_ranges(self, step_times, tail_lines):
+        # Every Actions log line starts with a timestamp, so the lines of a
+        # step are found by binary search on the step's started_at and
+        # completed_at (whole seconds) from the jobs API. tail_lines more
+        # lines are kept after each step for the runner's closing messages.
+        if not len(self) or not self.timestamp_at(0):
+            return []
+        ranges = []
+        for started_at, completed_at in step_times:
+            if not started_at or not completed_at:
+                return []
+            first = bisect.bisect_left(range(len(self)), started_at[:ACTIONS_TIMESTAMP_LENGTH], key=self.timestamp_at)
+            last = bisect.bisect_right(range(len(self)), completed_at[:ACTIONS_TIMESTAMP_LENGTH], key=self.timestamp_at) - 1
+            last = min(len(self) - 1, last + tail_lines)
+            if first > last:
+                continue
+            if ranges and first <= ranges[-1][1] + 1:
+                ranges[-1][1] = max(ranges[-1][1], last)
+            else:
+                ranges.append([first, last])
+        return ranges
+
+    def failure_windows(self, before, after, max_chars, line_ranges=None):
+        # Same windows as extract_failure_windows(), built from the marker
+        # line numbers instead of a pass over every line. With line_ranges,
+        # only markers inside those ranges count and windows stay inside them.
+        ranges = []
+        for range_first, range_last in line_ranges or [[0, len(self) - 1]]:
+            start, end = self.span(range_first, range_last)
+            for line in self.marker_lines(start=start, end=end):
+                first, last = max(range_first, line - before), min(range_last, line + after)
+                if ranges and first <= ranges[-1][1] + 1:
+                    ranges[-1][1] = max(ranges[-1][1], last)
+                else:
+                    ranges.append([first, last])
+
+        # Keep the most recent windows within the memory ceiling.
+        kept = []
+        kept_chars = 0
+        for first, last in reversed(ranges):
+            start, end = self.span(first, last)
+            if kept and kept_chars + end - start > max_chars:
+                break
+            if end - start > max_chars:
+                first = self.line_at(end - max_chars)
+            kept.append((first, last))
+            kept_chars += end - start
+        return [[self.text(first, last)] for first, last in reversed(kept)]
+
+    def tail_text(self, max_chars, first_line=0, last_line=None):
+        if not self.size:
+            return ""
+        last_line = len(self) - 1 if last_line is None else last_line
+        _, end = self.span(first_line, last_line)
+        tail_start = self.line_at(max(0, end - max_chars) - 1) + 1
+        return self.text(min(max(first_line, tail_start), last_line), last_line)
+
+def compact_log_lines(lines):
+    # Strips timestamps and ANSI codes, drops noise lines and the bodies of
+    # ##[group] blocks (step inputs and environment) unless they contain a
+    # failure marker, and collapses runs of lines that only differ in
+    # numbers or hashes into "<line> (×N)". Failure lines are only collapsed
+    # when they repeat exactly, as their numbers are file lines and test IDs.
+    previous_key = None
+    previous_line = None
+    repeats = 0
+    group_lines = None
+
+    def compacted(new_lines):
+        nonlocal previous_key, previous_line, repeats
+        for line in new_lines:
+            if FAILURE_MARKERS.search(line) or FAILURE_DETAILS.search(line):
+                key = line
+            else:
+                key = NEAR_DUPLICATE_DETAILS.sub("#", line)
+            if key == previous_key:
+                repeats += 1
+                continue
+            if previous_line is not None:
+                yield f"{previous_line} (×{repeats})\n" if repeats > 1 else previous_line + "\n"
+            previous_key, previous_line, repeats = key, line, 1
+
+    for line in lines:
+        line = ANSI_ESCAPE.sub("", ACTIONS_TIMESTAMP.sub("", line)).rstrip("\r\n")
+        if line.startswith("##[group]"):
+            yield from compacted(group_lines or [])
+            yield from compacted([line])
+            group_lines = []
+            continue
+        if line.startswith("##[endgroup]"):
+            if group_lines and any(FAILURE_MARKERS.search(group_line) for group_line in group_lines):
+                yield from compacted(group_lines)
+            group_lines = None
+            continue
+        if LOG_NOISE.match(line):
+            continue
+        if group_lines is not None:
+            group_lines.append(line)
+            if len(group_lines) > MAX_DROPPED_GROUP_LINES:
+                yield from compacted(group_lines)
+                group_lines = None
+            continue
+        yield from compacted([line])
+    yield from compacted(group_lines or [])
+    if previous_line is not None:
+        yield f"{previous_line} (×{repeats})\n" if repeats > 1 else previous_line + "\n"
+
+def prepare_log_excerpt(log_filename, args, max_log_chars, step_times=None):
+    # Returns the failure windows of the log, or its tail when there are no
+    # failure markers or --full-log is set. With --map-reduce the tail is
+    # replaced by None: the whole log is then streamed chunk by chunk.
+    if log_filename.endswith(".gz"):
+        if not args.full_log:
+            with open_log(log_filename) as file:
+                windows = extract_failure_windows(file, args.context_before, args.context_after, max_log_chars)
+            if windows:
+                log_content = format_failure_windows(windows)
+                print(f"Extracted {len(windows)} failure windows ({len(log_content)} characters) from {log_filename}")
+                return log_content
+        return None if args.map_reduce else read_log_tail(log_filename, max_log_chars)
+
+    with LogIndex(log_filename) as log_index:
+        if args.full_log:
+            return None if args.map_reduce else log_index.tail_text(max_log_chars)
+
+        # Only look at the failing steps' lines, so setup steps such as
+        # checkout, setup-python or cache restore never reach the prompt.
+        step_ranges = []
+        if not args.all_steps and step_times:
+            step_ranges = log_index.step_line_ranges(step_times, args.step_tail_lines)
+            if step_ranges:
+                step_lines = sum(last - first + 1 for first, last in step_ranges)
+                print(f"Limited {log_filename} to {step_lines} of {len(log_index)} lines from the failed steps")
+
+        windows = log_index.failure_windows(args.context_before, args.context_after, max_log_chars, step_ranges)
+        if windows:
+            log_content = format_failure_windows(windows)
+            print(f"Extracted {len(windows)} failure windows ({len(log_content)} characters) "
+                  f"from {len(log_index)} lines of {log_filename}")
+            return log_content
+        if step_ranges:
+            step_chars = max_log_chars // len(step_ranges)
+            return FAILURE_WINDOW_SEPARATOR.join(
+                log_index.tail_text(step_chars, first, last) for first, last in step_ranges
+            )
+        return None if args.map_reduce else log_index.tail_text(max_log_chars)
+
+def send_prompt_to_custom_service(prompt):
     headers = {
         'Cookie': os.getenv('CUSTOM_SERVICE_COOKIE'),
         'Content-Type': 'application/json'
     }
-    combined_logs = "\n".join(log_chunks)
     payload = {
         "messages": [
             {
@@ -52,80 +1226,714 @@ def analyze_logs_with_custom_service(log_chunks, tokenizer):
                 "content": [
                     {
                         "type": "text",
-                        "text": "Provide only a summary of the root cause of the job failure. Print the file name, line number and code exactly where job failed:\n\n" + combined_logs
+                        "text": prompt
                     }
                 ]
             }
         ]
     }
-    response = requests.post(url, json=payload, headers=headers)
-    response.raise_for_status()
-    print(f"Raw response content: {response.text}")
-    analysis_result = response.json()
-    summary = analysis_result.get('choices', [{}])[0].get('message', {}).get('content', 'No summary available')
-    return summary
+    with span("llm_request", prompt_chars=len(prompt)) as record:
+        queued = time.perf_counter()
+        with custom_service_slots:
+            record["queue_seconds"] = round(time.perf_counter() - queued, 6)
+            if stream_settings["enabled"]:
+                summary = stream_prompt_to_custom_service(payload, headers, record)
+                record["response_chars"] = len(summary)
+                return summary
+            response = http_request("POST", CUSTOM_SERVICE_URL, json=payload, headers=headers)
+        response.raise_for_status()
+        print(f"Raw response content: {response.text}")
+        analysis_result = response.json()
+        summary = analysis_result.get('choices', [{}])[0].get('message', {}).get('content', 'No summary available')
+        record["response_chars"] = len(summary)
+        return summary
+
+def stream_prompt_to_custom_service(payload, headers, record):
+    # The service answers with server-sent events: each "data:" line holds a
+    # JSON delta until "data: [DONE]". Lines of the summary are printed as
+    # they arrive. The read timeout bounds the wait for the first and every
+    # following event, and the whole exchange has its own deadline.
+    started = time.monotonic()
+    deadline = started + stream_settings["total_timeout"]
+    timeout = (http_settings["timeout"][0], stream_settings["first_byte_timeout"])
+    parts = []
+    pending = ""
+    first_token_at = None
+    with http_request("POST", CUSTOM_SERVICE_URL, json={**payload, "stream": True}, headers=headers,
+                      timeout=timeout, stream=True) as response:
+        response.raise_for_status()
+        response.encoding = 'utf-8'
+        for line in response.iter_lines(decode_unicode=True):
+            if time.monotonic() > deadline:
+                raise Exception(f"Analysis stream did not finish within {stream_settings['total_timeout']} seconds")
+            if not line.startswith("data:"):
+                continue
+            data = line[len("data:"):].strip()
+            if data == "[DONE]":
+                break
+            choice = (json.loads(data).get('choices') or [{}])[0]
+            content = (choice.get('delta') or choice.get('message') or {}).get('content')
+            if not content:
+                continue
+            if first_token_at is None:
+                first_token_at = time.monotonic()
+            parts.append(content)
+            *lines, pending = (pending + content).split("\n")
+            for text in lines:
+                print(f"Streamed: {text}")
+    if pending:
+        print(f"Streamed: {pending}")
+    if first_token_at is None:
+        return 'No summary available'
+
+    finished = time.monotonic()
+    tokens_per_second = len(parts) / max(finished - first_token_at, 1e-6)
+    record["tokens"] = len(parts)
+    record["time_to_first_token"] = round(first_token_at - started, 6)
+    print(f"Streamed {len(parts)} tokens: time to first token {first_token_at - started:.2f}s, "
+          f"total {finished - started:.2f}s, {tokens_per_second:.1f} tokens/s")
+    return "".join(parts)
+
+def analysis_prompt(step_names=None):
+    prompt = "Provide only a summary of the root cause of the job failure. Print the file name, line number and code exactly where job failed:\n\n"
+    if step_names:
+        prompt = f"Failed steps: {', '.join(step_names)}\n" + prompt
+    return prompt
+
+def analyze_logs_with_custom_service(log_chunks, tokenizer, step_names=None):
+    combined_logs = "\n".join(log_chunks)
+    return send_prompt_to_custom_service(analysis_prompt(step_names) + combined_logs)
+
+def summarize_chunks_map_reduce(log_chunks, step_names=None, max_in_flight=MAX_IN_FLIGHT_REQUESTS, load_chunk=None):
+    # log_chunks holds chunk text, or chunk references (such as byte offsets)
+    # that load_chunk turns into text inside the worker that sends it.
+    load_chunk = load_chunk or (lambda chunk: chunk)
+    if len(log_chunks) <= 1:
+        # An empty excerpt is sent like analyze_logs_with_custom_service() does.
+        return send_prompt_to_custom_service(analysis_prompt(step_names) + "".join(map(load_chunk, log_chunks)))
+
+    # Map: summarize every chunk in its own request. Reduce: merge the
+    # partial summaries, kept in log order, with one final request.
+    job_name = getattr(span_context, "job", None)
+
+    def summarize_chunk(indexed_chunk):
+        index, chunk = indexed_chunk
+        span_context.job = job_name
+        prompt = MAP_PROMPT.format(part=index + 1, parts=len(log_chunks))
+        return send_prompt_to_custom_service(prompt + load_chunk(chunk))
+
+    with ThreadPoolExecutor(max_workers=min(max_in_flight, len(log_chunks))) as executor:
+        partial_summaries = list(executor.map(summarize_chunk, enumerate(log_chunks)))
+
+    combined_summaries = "\n\n".join(
+        f"Part {index + 1}:\n{summary}" for index, summary in enumerate(partial_summaries)
+    )
+    return send_prompt_to_custom_service(REDUCE_PROMPT + analysis_prompt(step_names) + combined_summaries)
+
+def normalize_failure_text(text):
+    text = ANSI_ESCAPE.sub("", text)
+    text = ACTIONS_TIMESTAMP.sub("", text)
+    for pattern, replacement in FAILURE_SIGNATURE_PATTERNS:
+        text = pattern.sub(replacement, text)
+    return text
+
+class SummaryCache:
+    # On-disk cache of analysis summaries keyed by the hash of the normalized
+    # failure excerpt, with a TTL and least-recently-used eviction.
+    def __init__(self, path, ttl_hours=SUMMARY_CACHE_TTL_HOURS, max_entries=SUMMARY_CACHE_MAX_ENTRIES):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.ttl_seconds = ttl_hours * 3600
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        sqlite3 = timed_import("sqlite3")
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS summaries ("
+            "key TEXT PRIMARY KEY, summary TEXT NOT NULL, created_at REAL NOT NULL, last_used_at REAL NOT NULL)"
+        )
+        self.connection.commit()
+
+    @staticmethod
+    def key_for_lines(lines):
+        digest = hashlib.sha256()
+        for line in lines:
+            digest.update(normalize_failure_text(line).encode("utf-8"))
+        return digest.hexdigest()
+
+    @classmethod
+    def key_for(cls, log_content):
+        return cls.key_for_lines(log_content.splitlines(keepends=True))
+
+    def get(self, key):
+        now = time.time()
+        with self.lock:
+            row = self.connection.execute("SELECT summary, created_at FROM summaries WHERE key = ?", (key,)).fetchone()
+            if row is None or now - row[1] > self.ttl_seconds:
+                if row is not None:
+                    self.connection.execute("DELETE FROM summaries WHERE key = ?", (key,))
+                    self.connection.commit()
+                self.misses += 1
+                return None
+            self.connection.execute("UPDATE summaries SET last_used_at = ? WHERE key = ?", (now, key))
+            self.connection.commit()
+            self.hits += 1
+            return row[0]
+
+    def put(self, key, summary):
+        now = time.time()
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO summaries (key, summary, created_at, last_used_at) VALUES (?, ?, ?, ?)",
+                (key, summary, now, now)
+            )
+            self.connection.execute("DELETE FROM summaries WHERE created_at < ?", (now - self.ttl_seconds,))
+            self.connection.execute(
+                "DELETE FROM summaries WHERE key IN ("
+                "SELECT key FROM summaries ORDER BY last_used_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            )
+            self.connection.commit()
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+class FailureClusters:
+    # Groups the jobs of one run whose failure excerpts are near-duplicates,
+    # such as a matrix failing on the same assertion on every OS, so only the
+    # first job of a cluster is sent to the analysis service. Excerpts are
+    # normalized, numbers are masked so that versions and line numbers do not
+    # split a cluster, and generic lines such as exit codes are dropped. Two
+    # excerpts match when the Hamming distance of SimHash fingerprints over
+    # their lines is within max_distance and their failure lines, those
+    # naming the failing test, assertion or error, are identical.
+    def __init__(self, max_distance=CLUSTER_MAX_DISTANCE):
+        self.max_distance = max_distance
+        self.clusters = []  # (fingerprint, failure lines, representative job name, Future of its summary)
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def excerpt_lines(text):
+        # (masked line, whether it is a failure line) for each line that
+        # could tell two failures apart.
+        lines = [line.strip() for line in normalize_failure_text(text).splitlines()]
+        return [(NEAR_DUPLICATE_DETAILS.sub("#", line), bool(FAILURE_MARKERS.search(line) or FAILURE_DETAILS.search(line)))
+                for line in lines if line and not GENERIC_FAILURE_LINES.search(line)]
+
+    @staticmethod
+    def fingerprint(lines):
+        weights = [0] * 64
+        for line in lines:
+            line_hash = int.from_bytes(hashlib.blake2b(line.encode(), digest_size=8).digest(), 'big')
+            for bit in range(64):
+                weights[bit] += 1 if line_hash >> bit & 1 else -1
+        return sum(1 << bit for bit in range(64) if weights[bit] > 0)
+
+    def join(self, job_name, text):
+        # Returns (future, representative). With no representative the caller
+        # is the first of its cluster and must resolve the future; otherwise
+        # it waits for the representative's summary.
+        lines = self.excerpt_lines(text)
+        fingerprint = self.fingerprint(line for line, _ in lines)
+        failure_lines = sorted(line for line, is_failure_line in lines if is_failure_line)
+        with self.lock:
+            for other, other_failure_lines, representative, future in self.clusters:
+                # An excerpt with nothing but generic lines says too little
+                # to share another job's summary.
+                if lines and failure_lines == other_failure_lines and bin(fingerprint ^ other).count("1") <= self.max_distance:
+                    return future, representative
+            future = Future()
+            self.clusters.append((fingerprint, failure_lines, job_name, future))
+            return future, None
+
+def summarize_job_log(job, log_filename, log_content, tokenizer, args):
+    if log_content is None:
+        with span("tokenize", bytes=os.path.getsize(log_filename)) as record:
+            chunk_offsets = token_chunk_offsets(log_filename, args.chunk_tokens, tokenizer)
+            record["chunks"] = len(chunk_offsets)
+        with span("analyze"):
+            return summarize_chunks_map_reduce(
+                chunk_offsets, job["step_names"], args.max_in_flight,
+                load_chunk=lambda offsets: read_log_chunk(log_filename, *offsets)
+            )
+    with span("tokenize") as record:
+        log_chunks, record["tokens"] = chunk_text_by_tokens(log_content, args.chunk_tokens, tokenizer)
+        record["chunks"] = len(log_chunks)
+    with span("analyze"):
+        if args.map_reduce:
+            return summarize_chunks_map_reduce(log_chunks, job["step_names"], args.max_in_flight)
+        return analyze_logs_with_custom_service(log_chunks, tokenizer, job["step_names"])
+
+def analyze_failed_job(job, headers, tokenizer, args, summary_cache=None, failure_clusters=None):
+    timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
+    # Attempts of one job share its name (--filter all), so the job ID keeps
+    # their files apart.
+    log_filename = f"{job['job_name']}_logs_{job['job_id']}_{timestamp}.txt"
+    if job.get("output_dir"):
+        log_filename = os.path.join(job["output_dir"], log_filename)
+    if args.compress_logs:
+        log_filename += ".gz"
+    max_log_chars = args.max_log_memory_mb * 1024 * 1024
+    chunk_size = min(DOWNLOAD_CHUNK_SIZE, max_log_chars)
+    span_context.job = job["job_name"]
+    # Backfill and the service analyze many runs into one output directory:
+    # there only the analysis file is kept, not the job log.
+    try:
+        with span("download") as record:
+            if job.get("log_archive"):
+                extract_job_log_from_archive(job["log_archive"], job, log_filename, args.compress_logs)
+            elif args.tail_first:
+                download_log_tail(job["job_logs_url"], headers, log_filename, args.compress_logs,
+                                  args.tail_mb * 1024 * 1024, max_log_chars)
+            elif not download_logs(job["job_logs_url"], headers, log_filename, args.compress_logs, chunk_size):
+                raise Exception(f"Failed to download logs for {job['job_name']}")
+            record["bytes"] = os.path.getsize(log_filename)
+        return analyze_job_log(job, log_filename, timestamp, tokenizer, args, summary_cache, failure_clusters)
+    finally:
+        if job.get("output_dir") and os.path.exists(log_filename):
+            os.remove(log_filename)
+
+def analyze_job_log(job, log_filename, timestamp, tokenizer, args, summary_cache=None, failure_clusters=None):
+    max_log_chars = args.max_log_memory_mb * 1024 * 1024
+    with span("excerpt") as record:
+        log_content = prepare_log_excerpt(log_filename, args, max_log_chars, job.get("step_times"))
+        if log_content is not None and not args.no_compact:
+            token_counts = {"before": 0, "after": 0}
+            lines = counting_tokens(iter_text_lines(log_content), tokenizer, token_counts, "before")
+            compacted = "".join(counting_tokens(compact_log_lines(lines), tokenizer, token_counts, "after"))
+            if compacted.strip():
+                log_content = compacted
+            else:
+                # Only noise was left, such as a step tail of download
+                # progress: the raw excerpt is still better than nothing.
+                token_counts["after"] = token_counts["before"]
+            record["tokens"] = token_counts["after"]
+            print(f"Compacted log for {job['job_name']}: {token_counts['before']} -> {token_counts['after']} tokens "
+                  f"({token_counts['before'] - token_counts['after']} saved)")
+        record["chars"] = None if log_content is None else len(log_content)
+
+    # A whole log summarized with map-reduce is chunked by byte offsets and
+    # read back one chunk at a time, so it is never held in memory at once.
+    stream_full_log = log_content is None
+
+    cache_key = None
+    if summary_cache:
+        if stream_full_log:
+            with open_log(log_filename) as file:
+                cache_key = summary_cache.key_for_lines(file)
+        else:
+            cache_key = summary_cache.key_for(log_content)
+    summary = summary_cache.get(cache_key) if summary_cache else None
+    if summary is not None:
+        print(f"Using cached summary for {job['job_name']}")
+    else:
+        cluster, representative = None, None
+        if failure_clusters and not stream_full_log:
+            cluster, representative = failure_clusters.join(job["job_name"], log_content)
+        if representative:
+            try:
+                summary = cluster.result()
+                print(f"{job['job_name']} has the same failure as {representative}; reusing its summary")
+            except Exception:
+                # The representative could not be analyzed; try this job on its own.
+                representative = None
+                cluster = None
+        if not representative:
+            try:
+                summary = summarize_job_log(job, log_filename, log_content, tokenizer, args)
+            except Exception as e:
+                if cluster:
+                    cluster.set_exception(e)
+                raise
+            if cluster:
+                cluster.set_result(summary)
+        if summary_cache:
+            summary_cache.put(cache_key, summary)
+        if representative:
+            summary = f"Same failure as {representative}.\n\n{summary}"
+
+    # Save the summary to a file
+    # analysis_filename = f"./scripts/{step['job_name']}_{step['step_name']}_analysis_{timestamp}.txt"
+    # with open(analysis_filename, 'w') as analysis_file:
+    #     analysis_file.write(summary)
+    analysis_filename = os.path.join(job.get("output_dir", "./script"), f"{job['job_name']}_analysis_{job['job_id']}_{timestamp}.txt")
+    with open(analysis_filename, 'w') as analysis_file:
+        analysis_file.write(f"Job Name: {job['job_name']}\n")
+        analysis_file.write(f"Failed Steps: {', '.join(job['step_names'])}\n")
+        analysis_file.write(summary)
+
+    return summary, analysis_filename
+
+def report_job_result(job, future, failures):
+    with report_lock:
+        try:
+            summary, analysis_filename = future.result()
+        except Exception as e:
+            print(f"Failed to analyze logs for {job['job_name']} ({', '.join(job['step_names'])}): {str(e)}")
+            failures.append(job)
+            return
 
-def main():
+        # Print summary to logs
+        print(summary)
+        print(f"Analysis saved to {analysis_filename}")
+
+def parse_args(argv=None):
     parser = argparse.ArgumentParser()
     parser.add_argument('--run-id', required=False, help='The GITHUB_RUN_ID to use')
-    args = parser.parse_args()
+    parser.add_argument('--workers', type=int, default=1, help='Number of failed jobs to download and analyze concurrently')
+    parser.add_argument('--compress-logs', action='store_true', help='Store downloaded logs gzip-compressed on disk')
+    parser.add_argument('--max-log-memory-mb', type=int, default=MAX_LOG_MEMORY_MB, help='Maximum size of log text held in memory per job; larger logs keep only their tail')
+    parser.add_argument('--cpu-workers', type=int, default=1, help='Processes used to scan and tokenize large logs; 1 keeps preprocessing in-process')
+    parser.add_argument('--tail-first', action='store_true', help='Download only the end of each job log, growing the range backwards until a failure marker is found')
+    parser.add_argument('--tail-mb', type=int, default=TAIL_FETCH_MB, help='Size of the first range fetched with --tail-first')
+    parser.add_argument('--filter', choices=['latest', 'all'], default='latest', help='Analyze jobs from the latest run attempt only, or from every attempt')
+    parser.add_argument('--attempt', type=int, help='Analyze the jobs of a specific run attempt')
+    parser.add_argument('--context-before', type=int, default=CONTEXT_LINES_BEFORE, help='Log lines to send before each failure marker')
+    parser.add_argument('--context-after', type=int, default=CONTEXT_LINES_AFTER, help='Log lines to send after each failure marker')
+    parser.add_argument('--full-log', action='store_true', help='Send the whole log instead of the windows around failure markers')
+    parser.add_argument('--all-steps', action='store_true', help="Scan the whole job log instead of only the failed steps' lines")
+    parser.add_argument('--step-tail-lines', type=int, default=STEP_TAIL_LINES, help='Log lines kept after the end of each failed step')
+    parser.add_argument('--no-compact', action='store_true', help='Send log lines verbatim, without stripping timestamps, noise and repeated lines')
+    parser.add_argument('--chunk-tokens', type=int, default=MAX_TOKENS, help='Maximum tokens per log chunk')
+    parser.add_argument('--map-reduce', action='store_true', help='Summarize each log chunk in its own request and merge the partial summaries')
+    parser.add_argument('--max-in-flight', type=int, default=MAX_IN_FLIGHT_REQUESTS, help='Maximum concurrent requests to the analysis service')
+    parser.add_argument('--summary-cache', default=SUMMARY_CACHE_PATH, help='SQLite file used to cache summaries of previously seen failures')
+    parser.add_argument('--summary-cache-ttl-hours', type=float, default=SUMMARY_CACHE_TTL_HOURS, help='Hours a cached summary stays valid')
+    parser.add_argument('--summary-cache-max-entries', type=int, default=SUMMARY_CACHE_MAX_ENTRIES, help='Maximum cached summaries; least recently used ones are evicted first')
+    parser.add_argument('--no-summary-cache', action='store_true', help='Always ask the analysis service, without reading or writing the summary cache')
+    parser.add_argument('--cluster-distance', type=int, default=CLUSTER_MAX_DISTANCE, help='Most differing fingerprint bits for two jobs to count as the same failure')
+    parser.add_argument('--no-cluster', action='store_true', help='Analyze every failed job separately, even when several fail the same way')
+    parser.add_argument('--tokenizer-cache', default=TOKENIZER_CACHE_DIR, help='Directory holding the cached tokenizer BPE file; it is never downloaded during analysis')
+    parser.add_argument('--warm-tokenizer-cache', action='store_true', help='Download the tokenizer BPE file into --tokenizer-cache and exit')
+    parser.add_argument('--metrics-file', default=METRICS_FILE, help='JSON lines file for per-phase timings; a table of them is added to $GITHUB_STEP_SUMMARY')
+    parser.add_argument('--profile', metavar='DIR', help='Write cProfile stats and tracemalloc allocation reports per phase and job to DIR')
+    parser.add_argument('--profile-top', type=int, default=PROFILE_TOP_ALLOCATIONS, help='Allocation sites listed per phase with --profile')
+    parser.add_argument('--startup-report', action='store_true', help='Print how long imports and initialization took')
+    parser.add_argument('--connect-timeout', type=float, default=HTTP_CONNECT_TIMEOUT, help='Seconds allowed to connect to GitHub or the analysis service')
+    parser.add_argument('--read-timeout', type=float, default=HTTP_READ_TIMEOUT, help='Seconds allowed between bytes of a response')
+    parser.add_argument('--max-retries', type=int, default=HTTP_MAX_RETRIES, help='Retries for failed, 5xx and rate-limited requests')
+    parser.add_argument('--stream', action='store_true', help='Request a streamed analysis and print it as it arrives')
+    parser.add_argument('--first-byte-timeout', type=float, default=STREAM_FIRST_BYTE_TIMEOUT, help='Seconds a streamed analysis may wait for its first and each next event')
+    parser.add_argument('--total-timeout', type=float, default=STREAM_TOTAL_TIMEOUT, help='Seconds a streamed analysis may take end to end')
+    parser.add_argument('--http-cache-dir', default=HTTP_CACHE_DIR, help='Directory for cached GitHub API responses revalidated with ETag/Last-Modified')
+    parser.add_argument('--no-http-cache', action='store_true', help='Do not send conditional requests or cache GitHub API responses')
+    parser.add_argument('--archive', action='store_true', help='Download the whole run log archive once instead of one log per failed job')
+    parser.add_argument('--watch', action='store_true', help='Poll the run and analyze each failed job as soon as it finishes')
+    parser.add_argument('--watch-min-interval', type=float, default=WATCH_MIN_INTERVAL, help='Seconds between polls right after a job changed status')
+    parser.add_argument('--watch-max-interval', type=float, default=WATCH_MAX_INTERVAL, help='Longest wait between polls while nothing changes')
+    parser.add_argument('--watch-timeout', type=float, default=WATCH_TIMEOUT, help='Stop watching after this many seconds')
+    parser.add_argument('--since', type=parse_since, help='Backfill: analyze failed runs created in the last N days, or since a YYYY-MM-DD date')
+    parser.add_argument('--workflow', help='Backfill: only runs of this workflow (file name or ID)')
+    parser.add_argument('--runs-file', help='Backfill: file with one run ID per line')
+    parser.add_argument('--run-workers', type=int, default=BACKFILL_RUN_WORKERS, help='Backfill: runs analyzed at a time')
+    parser.add_argument('--backfill-db', default=BACKFILL_DB, help='Backfill: SQLite checkpoint used to resume an interrupted backfill')
+    parser.add_argument('--backfill-output-dir', default=BACKFILL_OUTPUT_DIR, help='Backfill: directory for per-run analyses; job logs are deleted once analyzed')
+    parser.add_argument('--watch-exclude', default=WATCH_EXCLUDE_JOBS, help='Regex of job names not to wait for, such as the job running this script')
+    args = parser.parse_args(argv)
+    if args.archive and args.watch:
+        parser.error("--archive needs a finished run and cannot be combined with --watch")
+    if args.tail_mb < 1:
+        parser.error("--tail-mb must be at least 1")
+    if args.watch and (args.since or args.runs_file or args.workflow):
+        parser.error("--watch follows a single run and cannot be combined with a backfill")
+    return args
+
+def configure(args):
+    # Applies the settings shared by every run: service concurrency, HTTP
+    # timeouts and cache, streaming, profiling and the CPU worker pool.
+    global custom_service_slots
+    custom_service_slots = threading.BoundedSemaphore(max(1, args.max_in_flight))
+    http_settings["timeout"] = (args.connect_timeout, args.read_timeout)
+    http_settings["max_retries"] = max(0, args.max_retries)
+    stream_settings["enabled"] = args.stream
+    stream_settings["first_byte_timeout"] = args.first_byte_timeout
+    stream_settings["total_timeout"] = args.total_timeout
+    global http_cache
+    if not args.no_http_cache:
+        http_cache = HttpCache(args.http_cache_dir)
+
+    if args.profile:
+        os.makedirs(args.profile, exist_ok=True)
+        timed_import("cProfile")
+        timed_import("tracemalloc")
+        profile_settings["dir"] = args.profile
+        profile_settings["top"] = args.profile_top
+
+    if args.cpu_workers > 1:
+        # Workers start lazily from a job thread while other threads hold
+        # locks, so they come from a fork server rather than a fork of this
+        # multithreaded process.
+        cpu_settings["workers"] = args.cpu_workers
+        cpu_settings["pool"] = ProcessPoolExecutor(max_workers=args.cpu_workers, initializer=init_cpu_worker,
+                                                   initargs=(args.tokenizer_cache,),
+                                                   mp_context=multiprocessing.get_context("forkserver"))
+
+def main():
+    args = parse_args()
+    if args.warm_tokenizer_cache:
+        load_tokenizer(args.tokenizer_cache, allow_download=True)
+        print(f"Tokenizer cached in {args.tokenizer_cache}")
+        return
+
+    configure(args)
+    try:
+        with span("run"):
+            analyze_repository(args)
+    finally:
+        if cpu_settings["pool"] is not None:
+            cpu_settings["pool"].shutdown()
+        print_http_stats()
+        write_metrics(args.metrics_file)
+        if args.profile:
+            print(f"Profiles saved to {args.profile}")
+        if args.startup_report:
+            print_startup_report()
+
+def github_headers(token):
+    return {
+        "Accept": "application/vnd.github+json",
+        "Authorization": f"Bearer {token}",
+        "X-GitHub-Api-Version": "2022-11-28"
+    }
 
+def analyze_repository(args):
     run_id = args.run_id or os.getenv('GITHUB_RUN_ID')
     repo_owner = os.getenv('REPO_OWNER')
     repo_name = os.getenv('REPO_NAME')
     token = os.getenv('GITHUB_TOKEN')
+    backfill = args.since or args.runs_file or args.workflow
 
     print(f"repo_owner: {repo_owner}")
     print(f"repo_name: {repo_name}")
     print(f"run_id: {run_id}")
     print(f"token: {token}")
     
-    if not all([repo_owner, repo_name, run_id, token]):
+    if not all([repo_owner, repo_name, run_id or backfill, token]):
         raise Exception("REPO_OWNER, REPO_NAME, GITHUB_RUN_ID, and GITHUB_TOKEN must be set")
 
-    headers = {
-        "Accept": "application/vnd.github+json",
-        "Authorization": f"Bearer {token}",
-        "X-GitHub-Api-Version": "2022-11-28"
-    }
-
-    failed_steps = get_failed_steps(repo_owner, repo_name, run_id, headers)
-    if not failed_steps:
-        print("No failed steps found.")
-        return
-
-    tokenizer = tiktoken.get_encoding("cl100k_base")
-
-    for step in failed_steps:
-        timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
-        log_filename = f"{step['job_name']}_{step['step_name']}_logs_{timestamp}.txt"
-        if not download_logs(step["job_logs_url"], headers, log_filename):
-            print(f"Failed to download logs for {step['job_name']} - {step['step_name']}")
-            continue
-
+    headers = github_headers(token)
+    if backfill:
+        backfill_runs(repo_owner, repo_name, headers, args)
+    else:
+        analyze_run(args, repo_owner, repo_name, run_id, headers)
+
+def analyze_run(args, repo_owner, repo_name, run_id, headers, tokenizer=None, summary_cache=None, executor=None, output_dir=None):
+    # Analyzes the failed jobs of one run. A backfill passes in the tokenizer,
+    # summary cache and job executor it shares across runs; otherwise they
+    # are created here. Returns the number of failed jobs and the jobs that
+    # could not be analyzed.
+    if args.watch:
+        failed_jobs = watch_failed_jobs(repo_owner, repo_name, run_id, headers, args)
+    else:
+        with span("list_jobs") as record:
+            failed_steps = get_failed_steps(repo_owner, repo_name, run_id, headers, args.filter, args.attempt)
+            record["failed_steps"] = len(failed_steps)
+        if not failed_steps:
+            print("No failed steps found.")
+            return 0, []
+        failed_jobs = group_failed_steps_by_job(failed_steps)
+        if output_dir:
+            os.makedirs(output_dir, exist_ok=True)
+            for job in failed_jobs:
+                job["output_dir"] = output_dir
+        if args.archive:
+            with span("download_archive") as record:
+                log_archive = download_run_log_archive(repo_owner, repo_name, run_id, headers, args.attempt, output_dir)
+                record["bytes"] = os.path.getsize(log_archive)
+            print(f"Downloaded run log archive {log_archive}")
+            for job in failed_jobs:
+                job["log_archive"] = log_archive
+
+    owns_summary_cache = summary_cache is None and not args.no_summary_cache
+    if tokenizer is None:
+        tokenizer = load_tokenizer(args.tokenizer_cache)
+    if owns_summary_cache:
+        summary_cache = SummaryCache(args.summary_cache, args.summary_cache_ttl_hours, args.summary_cache_max_entries)
+    failure_clusters = None if args.no_cluster else FailureClusters(args.cluster_distance)
+
+    failures = []
+    owns_executor = executor is None
+    if owns_executor:
+        executor = ThreadPoolExecutor(max_workers=max(1, args.workers))
+    try:
+        if args.watch:
+            # Each job is analyzed as soon as it fails, while the rest of the
+            # run is still going, and reported when its analysis finishes.
+            futures = []
+            for job in failed_jobs:
+                print(f"{job['job_name']} failed; starting analysis")
+                future = executor.submit(analyze_failed_job, job, headers, tokenizer, args, summary_cache, failure_clusters)
+                future.add_done_callback(lambda future, job=job: report_job_result(job, future, failures))
+                futures.append(future)
+            if not futures:
+                print("No failed steps found.")
+        else:
+            # Downloads and analysis run concurrently, but results are reported
+            # in the order the jobs were listed so the output stays deterministic.
+            futures = [executor.submit(analyze_failed_job, job, headers, tokenizer, args, summary_cache, failure_clusters)
+                       for job in failed_jobs]
+            for job, future in zip(failed_jobs, futures):
+                report_job_result(job, future, failures)
+    finally:
+        if owns_executor:
+            executor.shutdown()
+        if not args.watch and args.archive and os.path.exists(log_archive):
+            os.remove(log_archive)
+
+    if owns_summary_cache:
+        print(f"Summary cache: {summary_cache.hits} hits, {summary_cache.misses} misses")
+        summary_cache.close()
+    if failure_clusters and failure_clusters.clusters:
+        print(f"Failure clusters: {len(failure_clusters.clusters)} analyzed for {len(futures)} failed jobs")
+
+    if failures:
+        print(f"{len(failures)} of {len(futures)} failed jobs could not be analyzed.")
+    return len(futures), failures
+
+def parse_since(value):
+    # A number of days back, or a date such as 2024-05-01.
+    if value.isdigit():
+        return (datetime.now(timezone.utc) - timedelta(days=int(value))).strftime("%Y-%m-%d")
+    try:
+        return datetime.strptime(value, "%Y-%m-%d").strftime("%Y-%m-%d")
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"{value} is neither a number of days nor a YYYY-MM-DD date")
+
+def list_failed_runs(owner, repo, headers, since=None, workflow=None):
+    if workflow:
+        url = f"{GITHUB_API_URL}/repos/{owner}/{repo}/actions/workflows/{workflow}/runs"
+    else:
+        url = f"{GITHUB_API_URL}/repos/{owner}/{repo}/actions/runs"
+    params = {"per_page": RUNS_PER_PAGE, "status": "failure"}
+    if since:
+        params["created"] = f">={since}"
+
+    # Same concurrent paging as list_run_jobs(). The API returns at most
+    # BACKFILL_MAX_LISTED_RUNS runs for a filtered listing.
+    first_page = http_get_json(url, headers, {**params, "page": 1})
+    runs = first_page["workflow_runs"]
+    page_count = math.ceil(min(first_page["total_count"], BACKFILL_MAX_LISTED_RUNS) / RUNS_PER_PAGE)
+    if page_count > 1:
+        remaining_pages = range(2, page_count + 1)
+        with ThreadPoolExecutor(max_workers=min(len(remaining_pages), MAX_PAGE_WORKERS)) as executor:
+            for page in executor.map(lambda page: http_get_json(url, headers, {**params, "page": page}), remaining_pages):
+                runs.extend(page["workflow_runs"])
+    return [run["id"] for run in runs]
+
+def read_runs_file(runs_filename):
+    # One run ID per line; blank lines and # comments are skipped.
+    with open(runs_filename) as runs_file:
+        return [int(line.split("#")[0]) for line in runs_file if line.split("#")[0].strip()]
+
+class BackfillQueue:
+    # SQLite checkpoint of a backfill: every run found is queued once per
+    # repository, and its status is recorded as soon as it is analyzed, so
+    # rerunning an interrupted backfill only picks up the remaining runs.
+    # Failed runs are retried on later invocations up to max_attempts times.
+    def __init__(self, path, repository, max_attempts=BACKFILL_MAX_ATTEMPTS):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.repository = repository
+        self.max_attempts = max_attempts
+        self.lock = threading.Lock()
+        sqlite3 = timed_import("sqlite3")
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS runs ("
+            "repository TEXT NOT NULL, run_id INTEGER NOT NULL, status TEXT NOT NULL, attempts INTEGER NOT NULL, "
+            "failed_jobs INTEGER, error TEXT, updated_at REAL NOT NULL, PRIMARY KEY (repository, run_id))"
+        )
+        # Runs that were in progress when a previous backfill stopped.
+        self.connection.execute(
+            "UPDATE runs SET status = 'pending' WHERE repository = ? AND status = 'running'", (repository,)
+        )
+        self.connection.commit()
+
+    def add(self, run_ids):
+        with self.lock:
+            self.connection.executemany(
+                "INSERT OR IGNORE INTO runs (repository, run_id, status, attempts, updated_at) VALUES (?, ?, 'pending', 0, ?)",
+                [(self.repository, run_id, time.time()) for run_id in run_ids]
+            )
+            self.connection.commit()
+
+    def pending(self):
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT run_id FROM runs WHERE repository = ? AND (status = 'pending' OR (status = 'failed' AND attempts < ?)) "
+                "ORDER BY run_id", (self.repository, self.max_attempts)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def counts(self):
+        with self.lock:
+            return dict(self.connection.execute(
+                "SELECT status, COUNT(*) FROM runs WHERE repository = ? GROUP BY status", (self.repository,)
+            ).fetchall())
+
+    def mark(self, run_id, status, failed_jobs=None, error=None):
+        with self.lock:
+            self.connection.execute(
+                "UPDATE runs SET status = ?, attempts = attempts + (? != 'running'), failed_jobs = ?, error = ?, updated_at = ? "
+                "WHERE repository = ? AND run_id = ?",
+                (status, status, failed_jobs, error, time.time(), self.repository, run_id)
+            )
+            self.connection.commit()
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+def backfill_runs(repo_owner, repo_name, headers, args):
+    # Analyzes many runs in one process: --run-workers runs are listed and
+    # analyzed at a time, and their jobs share one executor, the HTTP
+    # sessions and caches, the tokenizer and the summary cache.
+    queue = BackfillQueue(args.backfill_db, f"{repo_owner}/{repo_name}")
+    run_ids = []
+    if args.runs_file:
+        run_ids.extend(read_runs_file(args.runs_file))
+    if args.since or args.workflow:
+        with span("list_runs") as record:
+            listed_run_ids = list_failed_runs(repo_owner, repo_name, headers, args.since, args.workflow)
+            record["runs"] = len(listed_run_ids)
+        run_ids.extend(listed_run_ids)
+    queue.add(run_ids)
+    pending = queue.pending()
+    print(f"Backfill: {len(run_ids)} runs found, {len(pending)} left to analyze")
+
+    tokenizer = load_tokenizer(args.tokenizer_cache) if pending else None
+    summary_cache = None
+    if pending and not args.no_summary_cache:
+        summary_cache = SummaryCache(args.summary_cache, args.summary_cache_ttl_hours, args.summary_cache_max_entries)
+
+    def backfill_run(run_id):
+        queue.mark(run_id, "running")
         try:
-            with open(log_filename, 'r') as file:
-                log_content = file.read()
-
-            log_chunks = chunk_text_by_tokens(log_content, MAX_TOKENS, tokenizer)
-            summary = analyze_logs_with_custom_service(log_chunks, tokenizer)
-
-            # Print summary to logs
-            print(summary)
-
-            # Save the summary to a file
-            # analysis_filename = f"./scripts/{step['job_name']}_{step['step_name']}_analysis_{timestamp}.txt"
-            # with open(analysis_filename, 'w') as analysis_file:
-            #     analysis_file.write(summary)
-            analysis_filename = f"./script/{step['job_name']}_analysis_{timestamp}.txt"
-            with open(analysis_filename, 'w') as analysis_file:
-                analysis_file.write(f"Job Name: {step['job_name']}\n")
-                analysis_file.write(summary)
-
-            print(f"Analysis saved to {analysis_filename}")
-
+            job_count, failures = analyze_run(
+                args, repo_owner, repo_name, run_id, headers, tokenizer, summary_cache, job_executor,
+                output_dir=os.path.join(args.backfill_output_dir, str(run_id))
+            )
         except Exception as e:
-            print(f"Failed to analyze logs for {log_filename}: {str(e)}")
+            print(f"Failed to backfill run {run_id}: {str(e)}")
+            queue.mark(run_id, "failed", error=str(e))
+            return
+        if failures:
+            queue.mark(run_id, "failed", job_count, f"{len(failures)} of {job_count} failed jobs could not be analyzed")
+        else:
+            queue.mark(run_id, "done", job_count)
+
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, args.workers)) as job_executor:
+            with ThreadPoolExecutor(max_workers=max(1, args.run_workers)) as run_executor:
+                list(run_executor.map(backfill_run, pending))
+    finally:
+        if summary_cache:
+            print(f"Summary cache: {summary_cache.hits} hits, {summary_cache.misses} misses")
+            summary_cache.close()
+        counts = queue.counts()
+        queue.close()
+    print("Backfill: " + ", ".join(f"{count} {status}" for status, count in sorted(counts.items())))
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,202 @@
+import argparse
+import atexit
+import hashlib
+import hmac
+import json
+import os
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import Flask, abort, jsonify, request
+
+import debug_fetch_logs as pipeline
+
+# Runs the debug_fetch_logs.py pipeline as a long-lived service instead of
+# once per workflow run: GitHub workflow_run webhooks for failed runs are
+# queued and analyzed by worker threads that keep the tokenizer, summary
+# cache, job executor and pooled HTTP sessions warm between runs.
+# python service.py runs Flask's development server; in production, serve
+# create_app() with a WSGI server such as gunicorn (see create_app()).
+
+SERVICE_HOST = os.getenv("SERVICE_HOST", "0.0.0.0")
+SERVICE_PORT = int(os.getenv("SERVICE_PORT", "8080"))
+SERVICE_OUTPUT_DIR = "./script/service"
+SERVICE_QUEUE_SIZE = 100  # Webhooks beyond this are rejected with 503 so GitHub shows them as failed deliveries
+SERVICE_RUN_WORKERS = 2
+
+app = Flask(__name__)
+run_queue = queue.Queue(maxsize=SERVICE_QUEUE_SIZE)
+queued_runs = set()  # (repository, run_id, attempt) queued or being analyzed; redeliveries are dropped
+service_lock = threading.Lock()
+service_stats = {"queued": 0, "analyzing": 0, "done": 0, "failed": 0, "ignored": 0}
+service_settings = {"secret": os.getenv("WEBHOOK_SECRET"), "token": os.getenv("GITHUB_TOKEN")}
+service_state = {}  # Run workers, summary cache and job executor while the service runs
+
+def verify_signature(body, signature):
+    expected = "sha256=" + hmac.new(service_settings["secret"].encode(), body, hashlib.sha256).hexdigest()
+    return hmac.compare_digest(expected, signature or "")
+
+def count(stat, change=1):
+    with service_lock:
+        service_stats[stat] += change
+
+@app.post("/webhook")
+def webhook():
+    if service_settings["secret"] and not verify_signature(request.get_data(), request.headers.get("X-Hub-Signature-256")):
+        abort(401)
+    event = request.headers.get("X-GitHub-Event")
+    if event == "ping":
+        return jsonify(status="pong")
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict):
+        return jsonify(status="invalid payload"), 400
+    run = payload.get("workflow_run") if isinstance(payload.get("workflow_run"), dict) else {}
+    if event != "workflow_run" or payload.get("action") != "completed" or run.get("conclusion") != "failure":
+        count("ignored")
+        return jsonify(status="ignored"), 202
+
+    repository = payload["repository"].get("full_name") if isinstance(payload.get("repository"), dict) else None
+    if not isinstance(repository, str) or "/" not in repository or not isinstance(run.get("id"), int) or isinstance(run["id"], bool):
+        return jsonify(status="invalid payload"), 400
+    key = (repository, run["id"], run.get("run_attempt"))
+    with service_lock:
+        if key in queued_runs:
+            return jsonify(status="already queued", run_id=run["id"]), 202
+        try:
+            run_queue.put_nowait(key)
+        except queue.Full:
+            return jsonify(status="queue full"), 503
+        queued_runs.add(key)
+        service_stats["queued"] += 1
+    print(f"Queued run {run['id']} of {repository} (attempt {key[2]})")
+    return jsonify(status="queued", run_id=run["id"]), 202
+
+@app.get("/healthz")
+def healthz():
+    with service_lock:
+        return jsonify(status="ok", backlog=run_queue.qsize(), **service_stats)
+
+def flush_metrics(metrics_filename):
+    # Spans would otherwise pile up for the life of the service, so each
+    # run's spans are appended to the metrics file and dropped from memory.
+    with pipeline.span_lock:
+        records = list(pipeline.spans)
+        del pipeline.spans[:]
+    if not records:
+        return
+    os.makedirs(os.path.dirname(os.path.abspath(metrics_filename)), exist_ok=True)
+    with open(metrics_filename, 'a') as metrics_file:
+        for record in records:
+            metrics_file.write(json.dumps(record) + "\n")
+
+def run_worker(args, tokenizer, summary_cache, job_executor, output_dir):
+    headers = pipeline.github_headers(service_settings["token"])
+    while True:
+        key = run_queue.get()
+        if key is None:
+            return
+        repository, run_id, attempt = key
+        repo_owner, repo_name = repository.split("/", 1)
+        # --attempt is per run here: the attempt that failed, not the latest.
+        run_args = argparse.Namespace(**{**vars(args), "attempt": attempt or args.attempt})
+        count("queued", -1)
+        count("analyzing")
+        try:
+            with pipeline.span("run", repository=repository, run_id=run_id):
+                job_count, failures = pipeline.analyze_run(
+                    run_args, repo_owner, repo_name, run_id, headers, tokenizer, summary_cache, job_executor,
+                    output_dir=os.path.join(output_dir, repository.replace("/", "_"), str(run_id))
+                )
+            count("failed" if failures else "done")
+        except Exception as e:
+            print(f"Failed to analyze run {run_id} of {repository}: {str(e)}")
+            count("failed")
+        finally:
+            count("analyzing", -1)
+            with service_lock:
+                queued_runs.discard(key)
+            flush_metrics(args.metrics_file)
+
+def start_service(argv=None):
+    # Parses the options, applies the pipeline settings, warms the tokenizer,
+    # summary cache and job executor, and starts the run workers.
+    parser = argparse.ArgumentParser(description='Analyze failed workflow runs from GitHub webhooks. '
+                                                 'Other arguments are passed to debug_fetch_logs.py.')
+    parser.add_argument('--host', default=SERVICE_HOST, help='Address to listen on')
+    parser.add_argument('--port', type=int, default=SERVICE_PORT, help='Port to listen on')
+    parser.add_argument('--service-run-workers', type=int, default=SERVICE_RUN_WORKERS, help='Runs analyzed at a time')
+    parser.add_argument('--output-dir', default=SERVICE_OUTPUT_DIR, help='Directory for per-run analyses; job logs are deleted once analyzed')
+    parser.add_argument('--allow-unsigned', action='store_true', help='Accept webhooks without WEBHOOK_SECRET set, for local testing')
+    service_args, pipeline_argv = parser.parse_known_args(argv)
+    args = pipeline.parse_args(pipeline_argv)
+    if args.watch or args.since or args.runs_file or args.workflow:
+        parser.error("--watch and backfill options do not apply to the service; each webhook names one finished run")
+    if not service_settings["token"]:
+        raise Exception("GITHUB_TOKEN must be set")
+    if not service_settings["secret"] and not service_args.allow_unsigned:
+        raise Exception("WEBHOOK_SECRET must be set, or pass --allow-unsigned")
+
+    pipeline.configure(args)
+    tokenizer = pipeline.load_tokenizer(args.tokenizer_cache)
+    summary_cache = None
+    if not args.no_summary_cache:
+        summary_cache = pipeline.SummaryCache(args.summary_cache, args.summary_cache_ttl_hours, args.summary_cache_max_entries)
+    job_executor = ThreadPoolExecutor(max_workers=max(1, args.workers))
+    # Daemon threads, so that interpreter exit does not wait for them before
+    # the atexit handler registered by create_app() can stop them.
+    workers = [threading.Thread(target=run_worker, args=(args, tokenizer, summary_cache, job_executor, service_args.output_dir),
+                                daemon=True)
+               for _ in range(max(1, service_args.service_run_workers))]
+    for worker in workers:
+        worker.start()
+    service_state.update(workers=workers, summary_cache=summary_cache, job_executor=job_executor)
+    return service_args
+
+def stop_service():
+    # Runs already being analyzed finish; runs still queued are dropped and
+    # GitHub can redeliver their webhooks.
+    workers = service_state.pop("workers", None)
+    if workers is None:
+        return
+    dropped = 0
+    while True:
+        try:
+            run_queue.get_nowait()
+            dropped += 1
+        except queue.Empty:
+            break
+    for _ in workers:
+        run_queue.put(None)
+    for worker in workers:
+        worker.join()
+    service_state["job_executor"].shutdown()
+    summary_cache = service_state["summary_cache"]
+    if summary_cache:
+        print(f"Summary cache: {summary_cache.hits} hits, {summary_cache.misses} misses")
+        summary_cache.close()
+    if pipeline.cpu_settings["pool"] is not None:
+        pipeline.cpu_settings["pool"].shutdown()
+    pipeline.print_http_stats()
+    if dropped:
+        print(f"{dropped} queued runs were not analyzed")
+
+def create_app(argv=()):
+    # Application factory for a WSGI server. The run queue and warm state
+    # live in this process, so run one server process with several threads:
+    #   gunicorn --chdir script --workers 1 --threads 8 'service:create_app(["--workers", "4"])'
+    start_service(list(argv))
+    atexit.register(stop_service)
+    return app
+
+def main():
+    # Flask's development server, for local testing; use create_app() with a
+    # WSGI server in production.
+    service_args = start_service()
+    try:
+        app.run(host=service_args.host, port=service_args.port, threaded=True)
+    finally:
+        stop_service()
+
+if __name__ == "__main__":
+    main()
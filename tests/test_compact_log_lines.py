@@ -0,0 +1,23 @@
+from debug_fetch_logs import compact_log_lines
+
+
+def compact(text):
+    return "".join(compact_log_lines(text.splitlines(keepends=True)))
+
+
+def test_noise_lines_differing_in_numbers_are_collapsed():
+    text = "Retrying in 1 seconds\nRetrying in 2 seconds\nRetrying in 3 seconds\n"
+    assert compact(text) == "Retrying in 1 seconds (×3)\n"
+
+
+def test_failure_lines_differing_in_numbers_are_kept():
+    text = ("src/a.c:12:5: error: 'x' undeclared\n"
+            "src/a.c:48:5: error: 'x' undeclared\n"
+            "FAILED tests/test_a.py::test_1 - AssertionError\n"
+            "FAILED tests/test_a.py::test_7 - AssertionError\n")
+    assert compact(text) == text
+
+
+def test_exactly_repeated_failure_lines_are_collapsed():
+    text = "src/a.c:12:5: error: 'x' undeclared\n" * 2
+    assert compact(text) == "src/a.c:12:5: error: 'x' undeclared (×2)\n"
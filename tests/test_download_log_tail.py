@@ -0,0 +1,64 @@
+import gzip
+
+import debug_fetch_logs
+
+
+class FakeResponse:
+    def __init__(self, status_code, headers=None, content=b""):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.content = content
+        self.is_redirect = status_code == 302
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def raise_for_status(self):
+        pass
+
+
+def serve_log(monkeypatch, log):
+    fetched_ranges = []
+
+    def http_request(method, url, headers=None, **kwargs):
+        if url != "https://blob/log":
+            return FakeResponse(302, {"Location": "https://blob/log"})
+        first, last = map(int, headers["Range"][len("bytes="):].split("-"))
+        fetched_ranges.append((first, last))
+        return FakeResponse(206, {"Content-Range": f"bytes {first}-{last}/{len(log)}"}, log[first:last + 1])
+
+    monkeypatch.setattr(debug_fetch_logs, "http_request", http_request)
+    return fetched_ranges
+
+
+def test_tail_grows_past_the_exit_code_to_the_traceback(monkeypatch, tmp_path):
+    log = (b"2024-05-01T10:00:00.0000000Z Setting up the job\n" * 200
+           + b"2024-05-01T10:01:00.0000000Z Traceback (most recent call last):\n"
+           + b"2024-05-01T10:01:00.0000000Z ValueError: invalid literal for int()\n"
+           + b"2024-05-01T10:01:01.0000000Z Cleaning up\n" * 20
+           + b"2024-05-01T10:01:02.0000000Z ##[error]Process completed with exit code 1.\n")
+    fetched_ranges = serve_log(monkeypatch, log)
+    output_filename = str(tmp_path / "job.txt.gz")
+
+    debug_fetch_logs.download_log_tail("https://api/logs", {}, output_filename, compress=True, tail_bytes=256)
+
+    with gzip.open(output_filename, 'rb') as file:
+        content = file.read()
+    assert fetched_ranges[1][0] > log.index(b"ValueError")
+    assert b"ValueError: invalid literal for int()" in content
+    assert b"exit code 1." in content
+    assert log.endswith(content) and len(content) < len(log)
+
+
+def test_tail_with_a_specific_failure_is_not_grown(monkeypatch, tmp_path):
+    log = (b"2024-05-01T10:00:00.0000000Z Setting up the job\n" * 200
+           + b"2024-05-01T10:01:00.0000000Z FAILED tests/test_parse.py::test_parse_int - AssertionError\n"
+           + b"2024-05-01T10:01:02.0000000Z ##[error]Process completed with exit code 1.\n")
+    fetched_ranges = serve_log(monkeypatch, log)
+
+    debug_fetch_logs.download_log_tail("https://api/logs", {}, str(tmp_path / "job.txt"), tail_bytes=256)
+
+    assert len(fetched_ranges) == 2
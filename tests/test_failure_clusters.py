@@ -0,0 +1,63 @@
+from debug_fetch_logs import FailureClusters
+
+NPM_FAILURE = """2024-05-01T10:{minute}:01.1234567Z > app@1.0.0 test
+2024-05-01T10:{minute}:01.2234567Z > jest --ci
+2024-05-01T10:{minute}:09.1234567Z FAIL src/components/{component}.test.js
+2024-05-01T10:{minute}:09.2234567Z   ● {component} › {test}
+2024-05-01T10:{minute}:09.3234567Z     expect(received).toEqual(expected)
+2024-05-01T10:{minute}:09.4234567Z     Expected: "{expected}"
+2024-05-01T10:{minute}:09.5234567Z     Received: undefined
+2024-05-01T10:{minute}:09.6234567Z       at Object.<anonymous> (src/components/{component}.test.js:{line}:23)
+2024-05-01T10:{minute}:10.1234567Z Tests:       1 failed, 2210 passed, 2211 total
+2024-05-01T10:{minute}:10.2234567Z npm ERR! code ELIFECYCLE
+2024-05-01T10:{minute}:10.3234567Z npm ERR! errno 1
+2024-05-01T10:{minute}:10.4234567Z npm ERR! app@1.0.0 test: `jest --ci`
+2024-05-01T10:{minute}:10.5234567Z npm ERR! Exit status 1
+2024-05-01T10:{minute}:10.6234567Z ##[error]Process completed with exit code 1.
+"""
+
+PYTEST_FAILURE = """2024-05-01T10:{minute}:00.0000000Z platform linux -- Python {python}, pytest-8.2.0
+2024-05-01T10:{minute}:05.0000000Z =================================== FAILURES ===================================
+2024-05-01T10:{minute}:05.1000000Z _________________________________ {test} _________________________________
+2024-05-01T10:{minute}:05.2000000Z >       assert parse("{value}") == {value}
+2024-05-01T10:{minute}:05.3000000Z E       AssertionError: assert None == {value}
+2024-05-01T10:{minute}:05.4000000Z /opt/hostedtoolcache/Python/{python}/x64/lib/python3/site-packages/app/parse.py:{line}: AssertionError
+2024-05-01T10:{minute}:05.5000000Z FAILED tests/unit/test_parse.py::{test} - AssertionError: assert None == {value}
+2024-05-01T10:{minute}:05.6000000Z ##[error]Process completed with exit code 1.
+"""
+
+
+def test_distinct_npm_failures_are_not_clustered():
+    clusters = FailureClusters()
+    first = NPM_FAILURE.format(minute=11, component="ParserrenderParse", test="parses input", expected="renderParse", line=41)
+    second = NPM_FAILURE.format(minute=12, component="ParserencodeParse", test="parses input", expected="encodeParse", line=41)
+
+    _, representative = clusters.join("job-0", first)
+    assert representative is None
+    _, representative = clusters.join("job-1", second)
+    assert representative is None
+    assert len(clusters.clusters) == 2
+
+
+def test_distinct_pytest_failures_are_not_clustered():
+    clusters = FailureClusters()
+    clusters.join("job-0", PYTEST_FAILURE.format(minute=1, python="3.12.3", test="test_parse_int", value=1, line=20))
+    _, representative = clusters.join("job-1", PYTEST_FAILURE.format(minute=1, python="3.12.3", test="test_parse_float", value=1, line=20))
+    assert representative is None
+
+
+def test_matrix_variants_of_one_failure_are_clustered():
+    clusters = FailureClusters()
+    future, representative = clusters.join("test (3.11)", PYTEST_FAILURE.format(minute=1, python="3.11.9", test="test_parse_int", value=7, line=20))
+    assert representative is None
+
+    same_future, representative = clusters.join("test (3.12)", PYTEST_FAILURE.format(minute=4, python="3.12.3", test="test_parse_int", value=7, line=22))
+    assert representative == "test (3.11)"
+    assert same_future is future
+
+
+def test_excerpts_with_only_generic_lines_are_not_clustered():
+    clusters = FailureClusters()
+    clusters.join("job-0", "npm ERR! code ELIFECYCLE\nnpm ERR! errno 1\n##[error]Process completed with exit code 1.\n")
+    _, representative = clusters.join("job-1", "npm ERR! code ELIFECYCLE\nnpm ERR! errno 1\n##[error]Process completed with exit code 1.\n")
+    assert representative is None
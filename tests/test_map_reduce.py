@@ -0,0 +1,9 @@
+import debug_fetch_logs
+
+
+def test_empty_chunk_list_is_sent_as_one_request(monkeypatch):
+    prompts = []
+    monkeypatch.setattr(debug_fetch_logs, "send_prompt_to_custom_service", lambda prompt: prompts.append(prompt) or "summary")
+
+    assert debug_fetch_logs.summarize_chunks_map_reduce([], ["Run tests"]) == "summary"
+    assert prompts == [debug_fetch_logs.analysis_prompt(["Run tests"])]
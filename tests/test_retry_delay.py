@@ -0,0 +1,31 @@
+import debug_fetch_logs
+
+
+class FakeResponse:
+    def __init__(self, status_code, headers=None, text=""):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.text = text
+
+
+SECONDARY_RATE_LIMIT_BODY = ('{"message": "You have exceeded a secondary rate limit. Please wait a few minutes before you try again.",'
+                             ' "documentation_url": "https://docs.github.com/rest/overview/rate-limits-for-the-rest-api"}')
+
+
+def test_secondary_rate_limit_without_retry_after_waits_at_least_a_minute():
+    response = FakeResponse(403, {"X-RateLimit-Remaining": "4999"}, SECONDARY_RATE_LIMIT_BODY)
+
+    assert debug_fetch_logs.retry_delay(response, 0) >= 60
+    assert debug_fetch_logs.retry_delay(response, 1) > debug_fetch_logs.retry_delay(response, 0)
+
+
+def test_secondary_rate_limit_with_retry_after_uses_it():
+    response = FakeResponse(403, {"Retry-After": "90"}, SECONDARY_RATE_LIMIT_BODY)
+
+    assert debug_fetch_logs.retry_delay(response, 0) == 90
+
+
+def test_other_forbidden_responses_are_not_retried():
+    response = FakeResponse(403, {"X-RateLimit-Remaining": "4999"}, '{"message": "Resource not accessible by integration"}')
+
+    assert debug_fetch_logs.retry_delay(response, 0) is None